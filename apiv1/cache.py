@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from functools import wraps
+from hashlib import md5
+from urllib.parse import urlencode
+from rest_framework import response, status
+
+from backend.cache import get_user_cache_version
+
+
+def get_user_cache_key(user, name, params=()):
+    """ユーザー・エンドポイント・クエリパラメータからキャッシュキーを生成"""
+
+    query = urlencode(sorted((key, value) for key, values in params for value in values))
+    digest = md5('{}?{}'.format(name, query).encode()).hexdigest()
+
+    # 今日までの集計が日付をまたいで使われないよう、日付もキーに含める
+    return 'user_cache:{}:{}:{}:{}'.format(user.pk, get_user_cache_version(user), timezone.localdate(), digest)
+
+
+def get_user_etag(user, name, params=()):
+    """キャッシュキーから、ユーザーのデータが変わるまで同じ値になるETagを生成"""
+
+    return md5(get_user_cache_key(user, name, params).encode()).hexdigest()
+
+
+def get_or_set_user_cache(user, name, default, params=()):
+    """ユーザーごとのキャッシュを取得 (ない場合はdefaultの戻り値を保存)"""
+
+    key = get_user_cache_key(user, name, params)
+    data = cache.get(key)
+    if data is None:
+        data = default()
+        cache.set(key, data, settings.USER_CACHE_TIMEOUT)
+
+    return data
+
+
+def cache_per_user(method):
+    """APIビューのGETレスポンスを、ユーザー・パス・クエリパラメータごとにキャッシュするデコレータ"""
+
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = get_user_cache_key(request.user, request.path, request.query_params.lists())
+        data = cache.get(key)
+        if data is not None:
+            return response.Response(data)
+
+        res = method(view, request, *args, **kwargs)
+        if res.status_code == status.HTTP_200_OK:
+            cache.set(key, res.data, settings.USER_CACHE_TIMEOUT)
+
+        return res
+
+    return wrapper
@@ -0,0 +1,52 @@
+"""
+ホーム画面のダッシュボード
+
+分析・最近の本・著者・直近一週間のページ数をまとめて返す。
+集計は日毎の集計 (DailyReadingStats)・著者の集計 (AuthorSummary) から求め、ユーザーのキャッシュのバージョンをETagに使う。
+"""
+
+from datetime import timedelta
+from django.utils.timezone import localdate
+
+from backend.models import AuthorSummary, Book, DailyReadingStats, StatusLog
+from .cache import get_or_set_user_cache, get_user_etag
+from .serializers import AnalyticsSerializer, AuthorSummarySerializer, BookSerializer, PagesDailySerializer
+
+
+def _get_dashboard(request):
+    user = request.user
+
+    status_log = StatusLog.objects.filter(created_by=user, position__gt=0).select_related('book')
+    daily_stats = DailyReadingStats.objects.filter(user=user)
+    analytics = AnalyticsSerializer(status_log, context={'request': request, 'daily_stats': daily_stats}).data
+
+    # recent_booksの先頭5件を取得
+    books = Book.objects.filter(created_by=user).sort_by_accessed_at().prefetch_authors()[:5]
+    recent_books = BookSerializer(books, many=True, context={'inside': True}).data
+
+    # authors_countの先頭6件を取得
+    authors = AuthorSummary.objects.filter(user=user).sort_by_books_count()[:6]
+    authors_count = AuthorSummarySerializer(authors, many=True).data
+
+    # 直近一週間に読んだページ数を日毎の集計から取得
+    pages_weekly = daily_stats.filter(date__gte=localdate() - timedelta(days=7), status_count__gt=0).order_by('-date')
+    pages_daily = PagesDailySerializer(pages_weekly, many=True).data
+
+    return {
+        **analytics,
+        'recent_books': recent_books,
+        'authors_count': authors_count,
+        'pages_daily': pages_daily
+    }
+
+
+def get_dashboard(request):
+    """ダッシュボードの集計を取得 (ユーザーのキャッシュがあればそれを使う)"""
+
+    return get_or_set_user_cache(request.user, 'dashboard', lambda: _get_dashboard(request))
+
+
+def get_dashboard_etag(user):
+    """ダッシュボードのETag (書き込みでキャッシュのバージョンが変わるか、日付が変わると変化する)"""
+
+    return get_user_etag(user, 'dashboard')
@@ -0,0 +1,109 @@
+"""
+読書記録のエクスポート (NDJSON・CSV)
+
+querysetを.iterator(chunk_size)で読み出し、chunkごとにシリアライズして書き出すため、
+メモリには1chunk分のオブジェクトしか保持しない。
+"""
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from rest_framework.renderers import JSONRenderer
+from itertools import islice
+import csv
+
+from backend.models import Author, Book, StatusLog, Note, prefetch_author_relations
+from .serializers import AuthorSerializer, BookSummarySerializer, StatusLogSerializer, NoteSerializer
+
+
+EXPORT_RESOURCES = ('books', 'authors', 'status', 'notes')
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+
+def _get_queryset(resource, user):
+    if resource == 'books':
+        # 進捗は一覧のAPIと同じく、積読に戻した本も直前の進捗の位置で出力する
+        return Book.objects.filter(created_by=user).annotate_progress_position().order_by('created_at', 'pk')
+    elif resource == 'authors':
+        return Author.objects.filter(books__created_by=user).sort_by_books_count().order_by('-books__count', 'name')
+    elif resource == 'status':
+        return StatusLog.objects.filter(created_by=user).select_related('book') \
+            .annotate_prev_position().order_by('created_at', 'pk')
+    elif resource == 'notes':
+        return Note.objects.filter(created_by=user).select_related('book').order_by('created_at', 'pk')
+
+
+def _serialize_chunk(resource, chunk):
+    """chunkをAPIと同じ形式でシリアライズ (書籍の入れ子は書籍のIDに置き換える)"""
+
+    if resource == 'books':
+        prefetch_related_objects(chunk, prefetch_author_relations())
+        return BookSummarySerializer(chunk, many=True).data
+    elif resource == 'authors':
+        return AuthorSerializer(chunk, many=True).data
+
+    serializer_class = StatusLogSerializer if resource == 'status' else NoteSerializer
+    data = serializer_class(chunk, many=True, context={'inside': True}).data
+    for item, instance in zip(data, chunk):
+        item['book'] = str(instance.book_id)
+
+    return data
+
+
+def iterate_records(resource, user, chunk_size=None):
+    """リソースのレコードを1件ずつ取得"""
+
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    iterator = _get_queryset(resource, user).iterator(chunk_size=chunk_size)
+
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            break
+
+        yield from _serialize_chunk(resource, chunk)
+
+
+def _flatten(data, prefix=''):
+    """CSV用に入れ子の値を展開 (position.value → position_value、リストは改行区切り)"""
+
+    ret = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            ret.update(_flatten(value, f'{prefix}{key}_'))
+        elif isinstance(value, list):
+            ret[prefix + key] = '\n'.join(str(_) for _ in value)
+        else:
+            ret[prefix + key] = value
+
+    return ret
+
+
+class _Echo():
+    """csv.writerの出力をそのまま返すためのバッファ"""
+
+    def write(self, value):
+        return value
+
+
+def export_ndjson(resources, user, chunk_size=None):
+    """NDJSON形式で出力 (1行に {"type": リソース名, "data": レコード} を書き出す)"""
+
+    renderer = JSONRenderer()
+    for resource in resources:
+        for record in iterate_records(resource, user, chunk_size):
+            yield renderer.render({'type': resource, 'data': record}) + b'\n'
+
+
+def export_csv(resource, user, chunk_size=None):
+    """CSV形式で出力 (1リソースのみ)"""
+
+    writer = csv.writer(_Echo())
+    fieldnames = None
+
+    for record in iterate_records(resource, user, chunk_size):
+        record = _flatten(record)
+        if fieldnames is None:
+            fieldnames = list(record.keys())
+            yield writer.writerow(fieldnames).encode('utf-8')
+
+        yield writer.writerow([record.get(name) for name in fieldnames]).encode('utf-8')
@@ -1,14 +1,36 @@
 from django.db.models.query import QuerySet
 from django_filters import rest_framework as django_filter
-from django.db.models import Q, F
+from django.db.models import Exists, OuterRef, Q, F
 from rest_framework.exceptions import ValidationError
 from functools import wraps
 
-from backend.models import Book, StatusLog, Note, Author
+from backend.models import Book, BookAuthorRelation, StatusLog, Note, Author, SearchDocument, STATE_CHOICES
+from backend.search import get_search_key_lookup
 import re
 
 
-STATE_CHOICES = (('to_be_read', 'To be read'), ('reading', 'Reading'), ('read', 'Read'))
+# 全文検索インデックスで検索するフィールド (検索対象のフィールド: (インデックスのフィールド, 絞り込むフィールド))
+SEARCH_INDEX_FIELDS = {
+    'title': ('title', 'id'),
+    'authors__name': ('authors', 'id'),
+    'book__title': ('title', 'book'),
+    'book__authors__name': ('authors', 'book'),
+    'content': ('content', 'id'),
+    'quote_text': ('quote_text', 'id'),
+}
+
+# 著者名の検索対象 (検索対象のフィールド: 書籍を参照するフィールド)
+# 著者との中間テーブルはEXISTSで調べ、結合で行が増えないようにする (DISTINCTを不要にする)
+AUTHOR_NAME_FIELDS = {
+    'authors__name': 'pk',
+    'book__authors__name': 'book',
+}
+
+# インデックスを使えない場合に、正規化した検索キーで検索するフィールド (検索対象のフィールド: 検索キーのフィールド)
+SEARCH_KEY_FIELDS = {
+    'title': 'title_search_key',
+    'book__title': 'book__title_search_key',
+}
 
 
 class GenericSearchFilterSet(django_filter.FilterSet):
@@ -31,7 +53,31 @@ class GenericSearchFilterSet(django_filter.FilterSet):
 
         return fields
 
-    def filter_search(self, queryset, name, value):
+    def _get_word_query(self, lookup, word):
+        """検索語のクエリを生成 (全文検索インデックスが使える場合はインデックスから絞り込む)"""
+
+        field_name = re.sub('__icontains$', '', lookup)
+        if field_name in SEARCH_INDEX_FIELDS:
+            index_field, target = SEARCH_INDEX_FIELDS[field_name]
+            user = getattr(self.request, 'user', None)
+            ids = SearchDocument.objects.search(index_field, word, user=user if user and user.is_authenticated else None)
+            if ids is not None:
+                return Q(**{f'{target}__in': ids})
+
+        # 検索語を検索キーと同じ方法で正規化して検索する (正規化して空になる検索語は元のまま部分一致)
+        if field_name in AUTHOR_NAME_FIELDS:
+            key_lookup = get_search_key_lookup('author__search_key', word) or {'author__name__icontains': word}
+            relations = BookAuthorRelation.objects.filter(book=OuterRef(AUTHOR_NAME_FIELDS[field_name]), **key_lookup)
+            return Q(Exists(relations))
+
+        if field_name in SEARCH_KEY_FIELDS:
+            return Q(**(get_search_key_lookup(SEARCH_KEY_FIELDS[field_name], word) or {lookup: word}))
+
+        return Q(**{lookup: word})
+
+    def _get_search_query(self, name, value):
+        """検索語 (スペース区切りでAND、ORキーワードでOR) からクエリを生成"""
+
         fields = self._get_cleaned_fields_for_search()
         query = Q()
         value = value.replace('　', ' ')
@@ -49,9 +95,9 @@ class GenericSearchFilterSet(django_filter.FilterSet):
             if name == 'q':
                 query_tmp = Q(id=None)
                 for field in fields:
-                    query_tmp |= Q(**{field: word})
+                    query_tmp |= self._get_word_query(field, word)
             else:
-                query_tmp = Q(**{name + '__icontains': word})
+                query_tmp = self._get_word_query(name + '__icontains', word)
 
             # is_orのフラグで分岐し、前のクエリとつなげる
             if is_or:
@@ -60,15 +106,43 @@ class GenericSearchFilterSet(django_filter.FilterSet):
             else:
                 query &= query_tmp
 
-        return queryset.filter(query).distinct()
+        return query
+
+    def filter_queryset(self, queryset):
+        """
+        検索のフィルタ (filter_search・filter_search_or) の条件は、宣言順にAND・ORでつないだ1つのQにまとめ、
+        その他のフィルタで絞り込んだquerysetに最後に1回だけ適用する
+        (検索の条件は複数の値を持つリレーションを結合しないため、DISTINCTは不要)
+        """
+
+        self._search_query = None
+        queryset = super().filter_queryset(queryset)
+
+        if self._search_query is not None:
+            queryset = queryset.filter(self._search_query)
+
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        query = self._get_search_query(name, value)
+        self._search_query = query if self._search_query is None else self._search_query & query
+        return queryset
 
     def filter_search_or(self, queryset: QuerySet, name, value):
-        return queryset | self.filter_search(queryset.model.objects.all(), name, value)
+        # ユーザーで絞り込んだquerysetの中で、それまでの検索条件とORでつなぐ
+        query = self._get_search_query(name, value)
+        self._search_query = query if self._search_query is None else self._search_query | query
+        return queryset
 
 
 class GenericEventFilterSet(django_filter.FilterSet):
     """イベント用フィルタ ミックスイン"""
 
+    def has_only_date_range(self):
+        """日付範囲以外の条件が指定されていないか"""
+
+        return not any(value for name, value in self.form.cleaned_data.items() if name not in ('created_at', 'accessed_at'))
+
     def filter_date_range(self, queryset, name, value):
         if name.startswith('accessed_at'):
             if hasattr(queryset, 'annotate_accessed_at'):
@@ -104,7 +178,7 @@ class BookFilter(GenericSearchFilterSet, GenericEventFilterSet):
 
     class Meta:
         model = Book
-        fields = '__all__'
+        exclude = ['title_search_key']
         fields_for_search = [
             'title__icontains',
             'authors__name__icontains',
@@ -176,7 +250,7 @@ class NoteFilter(GenericSearchFilterSet, GenericEventFilterSet):
 
     class Meta:
         model = Note
-        exclude = ['quote_image']
+        exclude = ['quote_image', 'quote_image_thumbnail']
         fields_for_search = [
             'book__title__icontains',
             'book__authors__name__icontains',
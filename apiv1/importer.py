@@ -0,0 +1,97 @@
+"""
+書籍・ステータスの一括登録
+
+行ごとにバリデーションを行い、エラーのない行をBook.objects.bulk_import・StatusLog.objects.bulk_recordでまとめて登録する。
+"""
+
+from django.db import IntegrityError
+from django.utils import timezone
+
+from backend.models import Book, StatusLog
+from .serializers import BookImportSerializer, StatusLogBatchSerializer
+
+
+def import_books(user, rows):
+    """書籍を一括登録し、行ごとの結果を返す"""
+
+    valid_rows, indexes, errors = [], [], []
+    for index, row in enumerate(rows):
+        serializer = BookImportSerializer(data=row)
+        if serializer.is_valid():
+            valid_rows.append(serializer.validated_data)
+            indexes.append(index)
+        else:
+            errors.append({'index': index, 'errors': serializer.errors})
+
+    books, skipped = Book.objects.bulk_import(user, valid_rows) if valid_rows else ([], [])
+
+    skipped_indexes = {indexes[j] for j, _ in skipped}
+    created_indexes = [index for index in indexes if index not in skipped_indexes]
+    return {
+        'created': [{'index': index, 'id': str(book.id)} for index, book in zip(created_indexes, books)],
+        'skipped': [{'index': indexes[j], 'id': str(book.id)} for j, book in skipped],
+        'errors': errors,
+    }
+
+
+def get_existing_status_result(user, index, status_id, owner_id):
+    """IDが登録済みのステータスの結果 (自ユーザーのものは再送としてスキップ、他のユーザーのものはエラー)"""
+
+    if owner_id == user.pk:
+        return {'index': index, 'id': str(status_id), 'result': 'skipped'}
+    return {'index': index, 'errors': {'id': ['このIDは使用できません。']}}
+
+
+def record_status_log(user, items):
+    """ステータスを一括登録し、項目ごとの結果を返す (IDが登録済みのステータスはスキップ)"""
+
+    results, valid_items = [], []
+    for index, item in enumerate(items):
+        serializer = StatusLogBatchSerializer(data=item)
+        if serializer.is_valid():
+            valid_items.append((index, serializer.validated_data))
+        else:
+            results.append({'index': index, 'errors': serializer.errors})
+
+    # 参照する書籍と、再送された登録済みのステータス (ID: 作成ユーザー) をまとめて取得
+    books = Book.objects.filter(created_by=user).in_bulk({data['book'] for _, data in valid_items})
+    ids = {data['id'] for _, data in valid_items if 'id' in data}
+    owners = dict(StatusLog.objects.filter(pk__in=ids).values_list('pk', 'created_by_id')) if ids else {}
+
+    pending = []
+    for index, data in valid_items:
+        book = books.get(data['book'])
+        if book is None:
+            results.append({'index': index, 'errors': {'book': ['自ユーザーが作成した本を選択してください。']}})
+        elif data['position'] > book.total:
+            results.append({'index': index, 'errors': {'position': ['位置の指定が不正です。']}})
+        elif data.get('id') in owners:
+            results.append(get_existing_status_result(user, index, data['id'], owners[data['id']]))
+        else:
+            status = StatusLog(book=book, position=data['position'], created_at=data.get('created_at') or timezone.now(), created_by=user)
+            if 'id' in data:
+                status.id = data['id']
+                owners[data['id']] = user.pk
+            pending.append((index, status))
+
+    created = []
+    if pending:
+        try:
+            StatusLog.objects.bulk_record(user, [status for _, status in pending])
+            created = pending
+        except IntegrityError:
+            # 確認後に同じIDのステータスが登録された場合は、1件ずつ登録し直して項目ごとの結果を返す
+            for index, status in pending:
+                try:
+                    StatusLog.objects.bulk_record(user, [status])
+                    created.append((index, status))
+                except IntegrityError:
+                    owner_id = StatusLog.objects.filter(pk=status.pk).values_list('created_by_id', flat=True).first()
+                    if owner_id is None:
+                        results.append({'index': index, 'errors': {'non_field_errors': ['ステータスを登録できませんでした。']}})
+                    else:
+                        results.append(get_existing_status_result(user, index, status.pk, owner_id))
+
+    results += [{'index': index, 'id': str(status.id), 'result': 'created'} for index, status in created]
+
+    return sorted(results, key=lambda result: result['index'])
@@ -1,5 +1,3 @@
-from django.conf import settings
-import os
 from typing import List, Any
 from collections import OrderedDict
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
@@ -7,27 +5,11 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.request import Request
 from rest_framework import response
 
+from backend.images import get_image_url
 
-class ImageSerializerMixin():
-    def _get_thumbnail(self, instance):
-        url = None
-
-        if hasattr(instance, 'photo') and instance.photo:
-            url = instance.photo.url
-        elif hasattr(instance, 'avatar') and instance.avatar:
-            url = instance.avatar.url
-
-        if url is not None:
-            if not settings.DEBUG:
-                CLOUDINARY_URL = 'https://res.cloudinary.com/' + os.environ['CLOUDINARY_CLOUD_NAME'] + '/image/upload'
-                if hasattr(instance, 'avatar'):
-                    prop = '/c_fill,h_128,w_128'
-                else:
-                    prop = '/c_fill,w_350'
 
-                url = url.replace(CLOUDINARY_URL, CLOUDINARY_URL + prop)
-
-            else:
-                url = '{}{}'.format(settings.HOST_URL, url)
+class ImageSerializerMixin():
+    def _get_thumbnail(self, instance, field_name='avatar'):
+        """サムネイルのURL (生成前の場合は元の画像のURL)"""
 
-        return url
+        return getattr(instance, f'{field_name}_thumbnail') or get_image_url(getattr(instance, field_name))
@@ -0,0 +1,173 @@
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination, response
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+import json
+
+
+def _get_keyset_query(created_at, pk, reverse=False):
+    """(created_at, id) のキーより後 (reverse=Trueの場合は前) の要素を取得するクエリ"""
+
+    if reverse:
+        return Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+    else:
+        return Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+
+
+def iterate_keyset_chunks(queryset, chunk_size, limit=None):
+    """querysetを (created_at, id) の降順で、OFFSETを使わずにchunk_sizeずつ取得"""
+
+    queryset = queryset.order_by('-created_at', '-pk')
+    count = 0
+    last = None
+
+    while limit is None or count < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - count)
+        chunk_queryset = queryset if last is None else queryset.filter(_get_keyset_query(last.created_at, last.pk))
+        chunk = list(chunk_queryset[:size])
+        if not chunk:
+            break
+
+        yield chunk
+
+        count += len(chunk)
+        last = chunk[-1]
+        if len(chunk) < size:
+            break
+
+
+class KeysetPagination(pagination.BasePagination):
+    """(created_at, id) をキーにしたカーソルページネーション (COUNT・OFFSETを使わない)"""
+
+    cursor_query_param = 'cursor'
+    page_size = 12
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+        if cursor is not None:
+            queryset = queryset.filter(_get_keyset_query(cursor['created_at'], cursor['pk'], reverse))
+
+        # 次のページの有無を判定するため、1件多く取得する
+        ordering = ('created_at', 'pk') if reverse else ('-created_at', '-pk')
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            created_at = parse_datetime(data['t'])
+            if created_at is None:
+                raise ValueError
+            return {'created_at': created_at, 'pk': data['id'], 'reverse': bool(data.get('r'))}
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound('不正なカーソルです。')
+
+    def encode_cursor(self, instance, reverse=False):
+        data = {'t': instance.created_at.isoformat(), 'id': str(instance.pk)}
+        if reverse:
+            data['r'] = 1
+
+        encoded = urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return response.Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'pageSize': self.page_size,
+            'results': data
+        })
+
+
+class TimelineListMixin():
+    """StatusLog・Noteの一覧用ミックスイン
+
+    ?pagination=cursor (またはcursorの指定) でカーソルページネーションを使用する。
+    ?stream=1 では、件数の上限付きで全件をJSONの配列としてストリーミングする。
+    """
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if params.get('stream') or params.get('no_pagination'):
+            return self.stream_list(request)
+
+        if params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in params:
+            self.pagination_class = KeysetPagination
+        elif params.get('pagination') not in (None, '', 'page'):
+            raise ValidationError({'pagination': 'page, cursorのいずれかを指定してください。'})
+
+        return super().list(request, *args, **kwargs)
+
+    def stream_list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        limit = settings.TIMELINE_STREAM_MAX_ITEMS
+
+        # 上限を超える場合はヘッダで通知する
+        is_truncated = queryset.order_by().values('pk')[limit:limit + 1].exists()
+
+        res = StreamingHttpResponse(self._render_stream(queryset, limit), content_type='application/json')
+        res['X-Result-Limit'] = limit
+        res['X-Result-Truncated'] = 'true' if is_truncated else 'false'
+        return res
+
+    def _render_stream(self, queryset, limit):
+        renderer = JSONRenderer()
+        yield b'['
+
+        is_first = True
+        for chunk in iterate_keyset_chunks(queryset, settings.TIMELINE_STREAM_CHUNK_SIZE, limit):
+            for item in self.get_serializer(chunk, many=True).data:
+                if not is_first:
+                    yield b','
+                yield renderer.render(item)
+                is_first = False
+
+        yield b']'
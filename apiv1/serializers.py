@@ -1,21 +1,22 @@
 from pkg_resources import ensure_directory
 from rest_framework import serializers
-from django.db.models import Q
+from django.db import models
+from django.db.models import Count, Exists, OuterRef, Q, QuerySet, Sum
 from rest_framework.exceptions import ValidationError
 from django.conf import settings
 from django.utils.timezone import localtime
 from django.core.mail import EmailMessage
 
 from .mixins import ImageSerializerMixin
-from backend.models import Author, Book, StatusLog, Note, BookAuthorRelation
+from backend.profiling import ProfilingSerializerMixin
+from backend.models import Author, AuthorSummary, Book, StatusLog, Note, BookAuthorRelation, SearchDocument, normalize_author_name
 
 from datetime import date, datetime, timedelta
 
 import math
-import re
 
 
-class PostSerializer(serializers.ModelSerializer, ImageSerializerMixin):
+class PostSerializer(ProfilingSerializerMixin, serializers.ModelSerializer, ImageSerializerMixin):
     def get_created_by(self, instance):
         from auth.serializers import CustomUserListSerializer
         return CustomUserListSerializer(instance.created_by, many=False, read_only=True).data
@@ -25,6 +26,14 @@ class PostSerializer(serializers.ModelSerializer, ImageSerializerMixin):
         validated_data['created_by'] = user
         return super().create(validated_data)
 
+    def _get_related(self, instance, name, *ordering):
+        """関連オブジェクトを取得 (先読み済みの場合はキャッシュから)"""
+
+        manager = getattr(instance, name)
+        if name in getattr(instance, '_prefetched_objects_cache', {}):
+            return manager.all()
+        return manager.order_by(*ordering)
+
 
 class BookIncludedSerializer(PostSerializer):
     def get_book(self, instance):
@@ -63,14 +72,20 @@ class BookIncludedSerializer(PostSerializer):
 class PageCountSerializerMixin():
     """ページ数カウント用 ミックスイン"""
 
-    def _get_diff(self, instance: StatusLog, prev_status: StatusLog):
-        book, position = instance.book, instance.position
+    def _get_prev_position(self, instance: StatusLog):
+        """
+        直前の進捗位置を取得 (querysetのannotate_prev_position()によるアノテーションが必要)
+        ステータスごとにクエリを発行しないよう、アノテーションがない場合は取得し直さずにエラーとする
+        """
 
-        prev_position = 0
-        for state in prev_status:
-            if state.position > 0:
-                prev_position = state.position
-                break
+        assert hasattr(instance, 'prev_position'), (
+            'StatusLogにprev_positionがアノテーションされていません。'
+            'querysetにannotate_prev_position()を指定してください。'
+        )
+        return instance.prev_position
+
+    def _get_diff(self, instance: StatusLog, prev_position: int):
+        book, position = instance.book, instance.position
 
         if position > prev_position:
             diff = position - prev_position
@@ -78,7 +93,7 @@ class PageCountSerializerMixin():
             diff = 0
 
         percentage = diff / book.total
-        page = math.ceil(book.total_page * percentage) if book.format_type == 1 else diff
+        page = math.ceil(book.total_page * diff / book.total) if book.format_type == 1 else diff
 
         return {
             'value': diff,
@@ -86,22 +101,45 @@ class PageCountSerializerMixin():
             'page': page
         }
 
-    def _get_diff_total(self, status_log: StatusLog, date_threshold=None):
+    def _get_diffs(self, status_log: QuerySet):
+        """ステータスごとの進捗を、直前の位置とあわせて1クエリで取得"""
+
+        for status in status_log.annotate_prev_position():
+            yield status, self._get_diff(status, status.prev_position)
+
+    def _get_diff_total(self, status_log: QuerySet, date_threshold=None):
         """進捗の累計ページ数を取得"""
 
         total, total_threshold = [0] * 2
-        for status in status_log:
-            book, created_at = status.book, status.created_at
-            prev_status = book.status_log.filter(created_at__lt=created_at).order_by('-created_at')
-            total += self._get_diff(status, prev_status)['page']
+        for status, diff in self._get_diffs(status_log):
+            total += diff['page']
 
             # 閾値の日付が指定されていた場合、閾値までの累計ページ数を取得
-            if date_threshold and date_threshold <= localtime(created_at).date():
+            if date_threshold and date_threshold <= localtime(status.created_at).date():
                 total_threshold = total
 
         return [total, total_threshold] if date_threshold else total
 
 
+class StatusLogListSerializer(serializers.ListSerializer):
+    """StatusLog 一覧用シリアライザ"""
+
+    def to_representation(self, data):
+        status_log = list(data.all() if isinstance(data, models.Manager) else data)
+
+        # ページ数カウント用: 直前の位置がアノテーションされていないステータスについて、まとめて取得しておく
+        missing = [status for status in status_log if not hasattr(status, 'prev_position')]
+        if missing:
+            prev_positions = dict(
+                StatusLog.objects.filter(pk__in=[status.pk for status in missing])
+                .annotate_prev_position().values_list('pk', 'prev_position')
+            )
+            for status in missing:
+                status.prev_position = prev_positions.get(status.pk, 0)
+
+        return super().to_representation(status_log)
+
+
 class StatusLogSerializer(BookIncludedSerializer, PageCountSerializerMixin):
     # created_by = serializers.SerializerMethodField()
     state = serializers.SerializerMethodField()
@@ -114,18 +152,31 @@ class StatusLogSerializer(BookIncludedSerializer, PageCountSerializerMixin):
             'created_at': {'required': False, 'allow_null': True},
             'book': {'write_only': True}
         }
-        prev_status = None
+        list_serializer_class = StatusLogListSerializer
 
     def to_representation(self, instance):
-        # ページ数カウント用: 事前にprev_statusを用意しておく
-        book, created_at = instance.book, instance.created_at
-        self.Meta.prev_status = book.status_log.filter(created_at__lt=created_at).order_by('-created_at')
-
         ret = super().to_representation(instance)
         ret['position'] = self.get_position(instance)
 
         return ret
 
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        self._annotate_prev_position(instance)
+        return instance
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # 作成日時や書籍の変更で直前の位置が変わるため、アノテーションを取得し直す
+        self._annotate_prev_position(instance)
+        return instance
+
+    def _annotate_prev_position(self, instance):
+        """作成・更新したステータス1件のレスポンス用に、直前の位置を取得してアノテーションする"""
+
+        instance.prev_position = StatusLog.objects.filter(pk=instance.pk).annotate_prev_position() \
+            .values_list('prev_position', flat=True).first() or 0
+
     def get_state(self, instance):
         if instance.position == 0:
             return 'to_be_read'
@@ -136,17 +187,14 @@ class StatusLogSerializer(BookIncludedSerializer, PageCountSerializerMixin):
 
     def get_diff(self, instance):
         # 前回までに進んだページ数 or 位置No
-        return self._get_diff(instance, self.Meta.prev_status)
+        return self._get_diff(instance, self._get_prev_position(instance))
 
     def get_position(self, instance):
         book, position = instance.book, instance.position
 
         if position == 0:
             # 積読中の場合、進捗の位置はその本の直前のステータスを参照する
-            for state in self.Meta.prev_status:
-                if state.position > 0:
-                    position = state.position
-                    break
+            position = self._get_prev_position(instance)
 
         percentage = position / book.total
         page = math.ceil(book.total_page * percentage) if book.format_type == 1 else position
@@ -159,6 +207,8 @@ class StatusLogSerializer(BookIncludedSerializer, PageCountSerializerMixin):
 
 
 class NoteSerializer(BookIncludedSerializer):
+    quote_image_thumbnail = serializers.SerializerMethodField()
+
     class Meta:
         model = Note
         exclude = ['created_by']
@@ -176,6 +226,9 @@ class NoteSerializer(BookIncludedSerializer):
             ret['quote_image'] = '{}{}'.format(settings.HOST_URL, quote_image)
         return ret
 
+    def get_quote_image_thumbnail(self, instance):
+        return self._get_thumbnail(instance, 'quote_image')
+
 
 class BookSerializer(PostSerializer):
     # created_by = serializers.SerializerMethodField()
@@ -188,10 +241,13 @@ class BookSerializer(PostSerializer):
 
     class Meta:
         model = Book
-        exclude = ['created_by']
+        exclude = ['created_by', 'title_search_key']
         extra_kwargs = {
             'created_at': {'required': False, 'read_only': True},
             'total_page': {'required': False, 'allow_null': True},
+            'current_position': {'read_only': True},
+            'state': {'read_only': True},
+            'last_accessed_at': {'read_only': True},
         }
 
     def to_representation(self, instance):
@@ -224,6 +280,8 @@ class BookSerializer(PostSerializer):
         for i, author in enumerate(authors):
             BookAuthorRelation.objects.create(order=i, book=book, author=author)
 
+        SearchDocument.objects.index_book(book, fields=['authors'])
+        AuthorSummary.objects.refresh_books([book.pk])
         return book
 
     def update(self, instance, validated_data):
@@ -236,13 +294,18 @@ class BookSerializer(PostSerializer):
             book = super().update(instance, validated_data)
 
             # 事前に中間テーブルを削除しておく
-            BookAuthorRelation.objects.filter(book=book).delete()
+            relations = BookAuthorRelation.objects.filter(book=book)
+            prev_author_ids = set(relations.values_list('author_id', flat=True))
+            relations.delete()
 
             for i, author in enumerate(authors):
                 BookAuthorRelation.objects.create(order=i, book=book, author=author)
 
-            # orphanedなAuthorオブジェクトを削除
-            Author.objects.filter(books=None).delete()
+            SearchDocument.objects.index_book(book, fields=['authors'])
+            AuthorSummary.objects.refresh(book.created_by, prev_author_ids | {author.pk for author in authors})
+
+            # 紐付けが外れた著者は、孤立していればバックグラウンドで削除する
+            Author.objects.mark_for_cleanup(prev_author_ids - {author.pk for author in authors})
 
         else:
             book = super().update(instance, validated_data)
@@ -255,11 +318,7 @@ class BookSerializer(PostSerializer):
         if not len(values):
             authors = ['不明']
         else:
-            authors = []
-            for value in values:
-                value = value.replace('　', ' ')
-                value = re.sub(r'([亜-熙ぁ-んァ-ヶ]) ([亜-熙ぁ-んァ-ヶ])', r'\1\2', value)
-                authors.append(value)
+            authors = [normalize_author_name(value) for value in values]
 
         return authors
 
@@ -281,7 +340,7 @@ class BookSerializer(PostSerializer):
         return data
 
     def get_status(self, instance):
-        status_log = instance.status_log.order_by('-created_at')
+        status_log = self._get_related(instance, 'status_log', '-created_at')
 
         if not self.context.get('inside'):
             data = StatusLogSerializer(status_log, many=True, read_only=True, context={'inside': True}).data
@@ -291,7 +350,7 @@ class BookSerializer(PostSerializer):
 
     def get_note(self, instance):
         if not self.context.get('inside'):
-            notes = instance.notes.order_by('position')
+            notes = self._get_related(instance, 'notes', 'position')
             return NoteSerializer(notes, many=True, read_only=True, context={'inside': True}).data
         else:
             return None
@@ -301,7 +360,79 @@ class BookSerializer(PostSerializer):
         return instance.thumbnail or NO_COVER_IMAGE
 
 
-class AnalyticsSerializer(serializers.Serializer, PageCountSerializerMixin):
+class BookSummarySerializer(BookSerializer):
+    """Book 一覧用シリアライザ (履歴・メモはcontextのexpandで指定された場合のみ含める)"""
+
+    progress = serializers.SerializerMethodField()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = self.context.get('expand', ())
+
+        for name in ('status', 'note'):
+            if name not in expand:
+                del fields[name]
+
+        return fields
+
+    def get_progress(self, instance: Book):
+        """現在の進捗 (StatusLogSerializerのstate/positionと同じ形式)"""
+
+        # 積読に戻した本は、直前の進捗の位置を表示する
+        position = getattr(instance, 'progress_position', None)
+        if position is None:
+            position = instance.current_position
+        percentage = position / instance.total
+        page = math.ceil(instance.total_page * percentage) if instance.format_type == 1 else position
+
+        return {
+            'state': instance.state,
+            'position': {
+                'value': position,
+                'percentage': int(percentage * 100),
+                'page': page
+            },
+            'created_at': serializers.DateTimeField().to_representation(instance.last_accessed_at),
+        }
+
+
+class StatusLogImportSerializer(serializers.Serializer):
+    """一括登録用 ステータスのシリアライザ"""
+
+    position = serializers.IntegerField(min_value=0)
+    created_at = serializers.DateTimeField(required=False)
+
+
+class BookImportSerializer(BookSerializer):
+    """一括登録用 書籍のシリアライザ (ステータスの履歴を含む)"""
+
+    status = StatusLogImportSerializer(many=True, required=False)
+    note = None
+
+    def validate(self, data):
+        data = super().validate(data)
+
+        if any(status['position'] > data['total'] for status in data.get('status', [])):
+            raise ValidationError({'status': '位置の指定が不正です。'})
+
+        return data
+
+
+class StatusLogBatchSerializer(serializers.Serializer):
+    """ステータス一括登録用シリアライザ (書籍の存在・位置の検証はまとめて行う)"""
+
+    id = serializers.UUIDField(required=False)
+    book = serializers.UUIDField()
+    position = serializers.IntegerField()
+    created_at = serializers.DateTimeField(required=False)
+
+    def validate_position(self, value):
+        if value < 0:
+            raise ValidationError('0以上の整数を入力してください。')
+        return value
+
+
+class AnalyticsSerializer(ProfilingSerializerMixin, serializers.Serializer, PageCountSerializerMixin):
     """分析用シリアライザ"""
 
     number_of_books = serializers.SerializerMethodField()
@@ -332,19 +463,43 @@ class AnalyticsSerializer(serializers.Serializer, PageCountSerializerMixin):
         # status_logに関連づけられたbooksをまとめて取得
         user = self.context['request'].user
 
-        # ステータスの対象にある本と、ステータスのない本を検索
+        # ステータスの対象にある本と、ステータスのない本を検索 (EXISTSで調べ、結合による重複を避ける)
         # BUG: クエリの関係上、積読状態を含む集計 (to_be_read/all) はフィルタによる範囲指定が効かない
         books = Book.objects.filter(
-            Q(status_log__in=status_log) | Q(created_by=user, status_log=None)
+            Q(Exists(status_log.filter(book=OuterRef('pk'))))
+            | Q(~Exists(StatusLog.objects.filter(book=OuterRef('pk'))), created_by=user)
+        )
+
+        # 読書状態ごとの冊数を1回のクエリで集計
+        counts = books.aggregate(
+            to_be_read=Count('pk', filter=Q(state='to_be_read')),
+            reading=Count('pk', filter=Q(state='reading')),
+            read=Count('pk', filter=Q(state='read')),
+            all=Count('pk'),
         )
 
         return {
-            'to_be_read': books.filter_by_state('to_be_read').count(),
-            'reading': books.filter_by_state('reading').count(),
-            'read': books.filter_by_state('read').count(),
-            'all': books.filter_by_state('all').count()
+            'to_be_read': counts['to_be_read'],
+            'reading': counts['reading'],
+            'read': counts['read'],
+            'all': counts['all']
         }
 
+    def _get_daily_stats(self):
+        """日毎の集計を日付範囲で絞り込んで取得 (コンテキストにない場合はNone)"""
+
+        daily_stats = self.context.get('daily_stats')
+        if daily_stats is None or not self.context.get('filterset'):
+            return daily_stats
+
+        created_at = self.context['filterset'].form.cleaned_data.get('created_at')
+        if getattr(created_at, 'start', None):
+            daily_stats = daily_stats.filter(date__gte=created_at.start.date())
+        if getattr(created_at, 'stop', None):
+            daily_stats = daily_stats.filter(date__lte=created_at.stop.date())
+
+        return daily_stats
+
     def get_pages_read(self, status_log: StatusLog):
         """読書ページ数の累計と、一日毎の平均ページ数を取得"""
 
@@ -359,7 +514,16 @@ class AnalyticsSerializer(serializers.Serializer, PageCountSerializerMixin):
         start_date, end_date = self._get_daterange_from_filterset()
 
         threshold_date = date_joined if start_date >= date_joined else start_date
-        total, total_for_avg = self._get_diff_total(status_log, threshold_date)
+        daily_stats = self._get_daily_stats()
+        if daily_stats is not None:
+            # 日毎の集計から求める
+            pages = daily_stats.aggregate(
+                total=Sum('pages'),
+                total_for_avg=Sum('pages', filter=Q(date__gte=threshold_date)),
+            )
+            total, total_for_avg = pages['total'] or 0, pages['total_for_avg'] or 0
+        else:
+            total, total_for_avg = self._get_diff_total(status_log, threshold_date)
         days_for_avg = (end_date - start_date).days + 1
 
         return {
@@ -371,7 +535,11 @@ class AnalyticsSerializer(serializers.Serializer, PageCountSerializerMixin):
         """トータルの読書日数、連続読書日数を取得"""
 
         # 記録された日数のset
-        date_set = set(status_log.values_list('created_at__date', flat=True))
+        daily_stats = self._get_daily_stats()
+        if daily_stats is not None:
+            date_set = set(daily_stats.filter(status_count__gt=0).values_list('date', flat=True))
+        else:
+            date_set = set(status_log.values_list('created_at__date', flat=True))
         sorted_date_set = sorted(list(date_set))
         cur_date, continuous_list = None, []
 
@@ -404,7 +572,7 @@ class AnalyticsSerializer(serializers.Serializer, PageCountSerializerMixin):
         }
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(ProfilingSerializerMixin, serializers.ModelSerializer):
     """著者名リスト用シリアライザ"""
 
     count = serializers.SerializerMethodField()
@@ -417,28 +585,25 @@ class AuthorSerializer(serializers.ModelSerializer):
         return instance.books__count
 
 
-class PagesDailySerializer(serializers.Serializer, PageCountSerializerMixin):
-    """
-    ページ数集計用シリアライザ
-    (instanceにはdate_createdがmany=Trueで入る。コンテキストからquerysetを取得。)
-    """
+class AuthorSummarySerializer(ProfilingSerializerMixin, serializers.ModelSerializer):
+    """著者名リスト用シリアライザ (著者の集計から取得)"""
 
-    date = serializers.SerializerMethodField()
-    pages = serializers.SerializerMethodField()
+    name = serializers.CharField(source='author.name')
+    count = serializers.IntegerField()
+
+    class Meta:
+        model = AuthorSummary
+        fields = ['name', 'count']
 
-    def get_date(self, date_created):
-        return date_created
 
-    def get_pages(self, date_created):
-        """一日毎のページ数集計を取得"""
-        queryset = self.context['queryset']
-        status_daily = []
-        for status in queryset:
-            if localtime(status.created_at).date() == date_created:
-                status_daily.append(status)
+class PagesDailySerializer(ProfilingSerializerMixin, serializers.Serializer):
+    """
+    ページ数集計用シリアライザ
+    (instanceにはStatusLogQuerySet.sum_pages_by_dateの集計がmany=Trueで入る。)
+    """
 
-        pages_daily = self._get_diff_total(status_daily)
-        return pages_daily
+    date = serializers.DateField()
+    pages = serializers.IntegerField()
 
 
 class InquirySerializer(serializers.Serializer):
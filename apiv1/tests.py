@@ -0,0 +1,644 @@
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock, skipUnless
+import uuid
+import csv
+import io
+import json
+import requests
+import threading
+
+from backend.management.commands.check_query_plans import get_queries, uses_index
+from backend.metadata import BookMetadataService, GoogleBooksUpstream
+from backend.search import get_search_backend
+from backend.models import Author, AuthorSummary, Book, BookAuthorRelation, BookMetadata, CustomUser, DailyReadingStats, Note, SearchDocument, StatusLog
+
+from .serializers import StatusLogSerializer
+from .views import CustomPageNumberPagination
+
+
+def create_books(user, books_count, logs_per_book=3):
+    """著者・ステータス・メモを持つ書籍を作成"""
+
+    for i in range(books_count):
+        book = Book.objects.create(id_google=f'{i:012d}', title=f'本 {i}', total=300, created_by=user)
+        BookAuthorRelation.objects.create(book=book, author=Author.objects.create(name=f'著者 {i}'), order=0)
+        for j in range(logs_per_book):
+            StatusLog.objects.create(book=book, position=(j + 1) * 10, created_by=user)
+            Note.objects.create(book=book, position=(j + 1) * 10, content=f'メモ {j}', created_by=user)
+
+
+class ListQueryCountTests(APITestCase):
+    """一覧APIのクエリ数が、ページの件数・データ量によらず一定であること (N+1の検出)"""
+
+    # (冊数, 1ページの件数) の組み合わせ。どの組み合わせでも同じクエリ数になる
+    scales = ((3, 2), (15, 12))
+
+    def assert_constant_queries(self, path, num):
+        for books_count, page_size in self.scales:
+            with self.subTest(path=path, books_count=books_count, page_size=page_size):
+                user = CustomUser.objects.create_user(f'user{books_count}', f'user{books_count}@example.com')
+                create_books(user, books_count)
+                self.client.force_authenticate(user)
+
+                with mock.patch.object(CustomPageNumberPagination, 'page_size', page_size):
+                    with self.assertNumQueries(num):
+                        res = self.client.get(path)
+
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(len(res.data['results']), page_size)
+
+    def test_book_list(self):
+        self.assert_constant_queries('/api/v1/book/', 3)
+
+    def test_book_list_expand(self):
+        self.assert_constant_queries('/api/v1/book/?expand=status,note', 5)
+
+    def test_status_list(self):
+        self.assert_constant_queries('/api/v1/status/', 3)
+
+    def test_note_list(self):
+        self.assert_constant_queries('/api/v1/note/', 3)
+
+
+class StatusLogDiffTests(APITestCase):
+    """ステータスの進捗 (直前の位置からの差分) の計算"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        self.book = Book.objects.create(id_google='000000000001', title='本', total=300, created_by=self.user)
+        StatusLog.objects.create(book=self.book, position=100, created_at=timezone.now() - timedelta(hours=1), created_by=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_create_and_update_response(self):
+        res = self.client.post('/api/v1/status/', {'book': str(self.book.id), 'position': 150}, format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['diff']['value'], 50)
+
+        res = self.client.patch(f'/api/v1/status/{res.data["id"]}/', {'position': 120}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['diff']['value'], 20)
+
+    def test_to_be_read_position(self):
+        # 積読に戻したステータスの位置は、直前の進捗の位置になる
+        res = self.client.post('/api/v1/status/', {'book': str(self.book.id), 'position': 0}, format='json')
+        self.assertEqual(res.data['position']['value'], 100)
+        self.assertEqual(res.data['diff']['value'], 0)
+
+    def test_requires_annotation(self):
+        # アノテーションのないステータスを1件ずつシリアライズすると、ステータスごとにクエリが発行されるためエラーにする
+        status = StatusLog.objects.create(book=self.book, position=200, created_by=self.user)
+        with self.assertRaises(AssertionError):
+            StatusLogSerializer(status).data
+
+        # 一覧のシリアライザは、アノテーションのないステータスの直前の位置をまとめて取得する
+        status_log = list(StatusLog.objects.select_related('book'))
+        with self.assertNumQueries(1):
+            data = StatusLogSerializer(status_log, many=True, context={'inside': True}).data
+        self.assertEqual([item['diff']['value'] for item in data], [100, 100])
+
+
+class DailyReadingStatsTests(APITestCase):
+    """ステータスの保存・削除で、日毎の集計が全件の再計算と同じ値に更新されること"""
+
+    fields = ('date', 'pages', 'status_count', 'books_to_be_read', 'books_reading', 'books_read', 'first_activity_at', 'last_activity_at')
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        self.book = Book.objects.create(id_google='000000000001', title='本', total=300, created_by=self.user)
+        self.now = timezone.now().replace(hour=3, minute=0, second=0, microsecond=0)
+
+    def create_status(self, position, days_ago):
+        return StatusLog.objects.create(
+            book=self.book, position=position, created_at=self.now - timedelta(days=days_ago), created_by=self.user
+        )
+
+    def get_stats(self):
+        return list(DailyReadingStats.objects.filter(user=self.user).order_by('date').values(*self.fields))
+
+    def assert_stats_rebuilt(self):
+        stats = self.get_stats()
+        DailyReadingStats.objects.rebuild(self.user)
+        self.assertEqual(stats, self.get_stats())
+
+    def test_create(self):
+        self.create_status(100, days_ago=3)
+        self.create_status(150, days_ago=1)
+        self.assert_stats_rebuilt()
+
+        # 過去の日付に追加すると、同じ書籍の次の進捗の日付の集計も変わる
+        self.create_status(120, days_ago=2)
+        self.assert_stats_rebuilt()
+        self.assertEqual(DailyReadingStats.objects.get(user=self.user, date=(self.now - timedelta(days=1)).date()).pages, 30)
+
+    def test_update(self):
+        self.create_status(100, days_ago=3)
+        status = self.create_status(150, days_ago=2)
+        self.create_status(200, days_ago=1)
+
+        status.position = 180
+        status.save()
+        self.assert_stats_rebuilt()
+
+        # 作成日時を別の日に移すと、移動前・移動後の日付の集計が変わる
+        status.created_at = self.now - timedelta(days=4)
+        status.save()
+        self.assert_stats_rebuilt()
+        self.assertFalse(DailyReadingStats.objects.filter(user=self.user, date=(self.now - timedelta(days=2)).date()).exists())
+
+    def test_delete(self):
+        self.create_status(100, days_ago=3)
+        status = self.create_status(150, days_ago=2)
+        self.create_status(200, days_ago=1)
+
+        status.delete()
+        self.assert_stats_rebuilt()
+        self.assertEqual(DailyReadingStats.objects.get(user=self.user, date=(self.now - timedelta(days=1)).date()).pages, 100)
+
+    def test_book_total_change(self):
+        self.create_status(100, days_ago=2)
+        self.create_status(300, days_ago=1)
+
+        self.book.total = 200
+        self.book.save()
+        self.assert_stats_rebuilt()
+
+
+class UserCacheInvalidationTests(APITestCase):
+    """API以外 (モデルの直接の保存・削除) からデータを更新しても、ユーザーごとのキャッシュが無効化されること"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        self.book = Book.objects.create(id_google='000000000001', title='本', total=300, created_by=self.user)
+        self.author = Author.objects.create(name='著者')
+        BookAuthorRelation.objects.create(book=self.book, author=self.author, order=0)
+        AuthorSummary.objects.refresh_books([self.book.pk])
+        self.client.force_authenticate(self.user)
+
+    def test_status_log(self):
+        before = self.client.get('/api/v1/analytics/').data
+
+        with self.captureOnCommitCallbacks(execute=True):
+            status = StatusLog.objects.create(book=self.book, position=100, created_by=self.user)
+        after = self.client.get('/api/v1/analytics/').data
+        self.assertNotEqual(before, after)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            status.delete()
+        self.assertEqual(self.client.get('/api/v1/analytics/').data, before)
+
+    def test_author(self):
+        self.assertEqual(self.client.get('/api/v1/author/').data['results'][0]['name'], '著者')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.name = '別の著者'
+            self.author.save()
+        self.assertEqual(self.client.get('/api/v1/author/').data['results'][0]['name'], '別の著者')
+
+
+class SearchTests(APITestCase):
+    """書籍・ステータス・メモのフリーワード検索"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        self.client.force_authenticate(self.user)
+
+    def create_book(self, title, author_name, user=None):
+        book = Book.objects.create(id_google=f'{Book.objects.count():012d}', title=title, total=300, created_by=user or self.user)
+        BookAuthorRelation.objects.create(book=book, author=Author.objects.get_or_create(name=author_name)[0], order=0)
+        SearchDocument.objects.index_books([book])
+        return book
+
+    def search(self, path, q):
+        res = self.client.get(path, {'q': q})
+        self.assertEqual(res.status_code, 200)
+        return sorted(item['id'] for item in res.data['results'])
+
+    def test_single_character(self):
+        # 1文字の検索語は、正規化した検索キー (タイトル・著者名) の前方一致で検索する
+        book1 = self.create_book('ネコの本', '夏目 漱石')
+        book2 = self.create_book('本の猫', 'なつめ')
+        self.create_book('ねこ', '著者', user=CustomUser.objects.create_user('other', 'other@example.com'))
+
+        self.assertEqual(self.search('/api/v1/book/', 'ね'), [str(book1.id)])
+        self.assertEqual(self.search('/api/v1/book/', 'ﾈ'), [str(book1.id)])
+        self.assertEqual(self.search('/api/v1/book/', '本'), [str(book2.id)])
+        self.assertEqual(self.search('/api/v1/book/', '夏'), [str(book1.id)])
+        self.assertEqual(self.search('/api/v1/book/', 'ナ'), [str(book2.id)])
+
+    def test_bigram_index(self):
+        if get_search_backend() is None:
+            self.skipTest('全文検索のインデックスを使えないデータベース')
+
+        book1 = self.create_book('ノルウェイの森', '村上 春樹')
+        book2 = self.create_book('森の生活', 'ソロー')
+        self.create_book('ノルウェイの森', '村上 春樹', user=CustomUser.objects.create_user('other', 'other@example.com'))
+        note = Note.objects.create(book=book2, position=10, content='ウォールデン湖のほとり', created_by=self.user)
+        status_log = StatusLog.objects.create(book=book1, position=10, created_by=self.user)
+
+        # 正規化 (全角・半角、カタカナ・ひらがな、空白・記号) した文字列の部分一致で、自ユーザーのものだけを検索する
+        self.assertEqual(self.search('/api/v1/book/', 'のるうぇい'), [str(book1.id)])
+        self.assertEqual(self.search('/api/v1/book/', 'ﾉﾙｳｪｲ'), [str(book1.id)])
+        self.assertEqual(self.search('/api/v1/book/', 'の森'), [str(book1.id)])
+        self.assertEqual(self.search('/api/v1/book/', '森の'), [str(book2.id)])
+        self.assertEqual(self.search('/api/v1/book/', '上春'), [str(book1.id)])
+        self.assertEqual(self.search('/api/v1/book/', 'の森 OR ソロ'), sorted([str(book1.id), str(book2.id)]))
+        self.assertEqual(self.search('/api/v1/book/', 'の森 ソロ'), [])
+        self.assertEqual(self.search('/api/v1/book/', '森林'), [])
+
+        self.assertEqual(self.search('/api/v1/note/', 'デン湖'), [str(note.id)])
+        self.assertEqual(self.search('/api/v1/note/', '生活'), [str(note.id)])
+        self.assertEqual(self.search('/api/v1/status/', 'むらかみ'), [])
+        self.assertEqual(self.search('/api/v1/status/', '村上'), [str(status_log.id)])
+
+    def test_without_index(self):
+        # 全文検索のインデックスを使えない場合は、正規化した検索キーの部分一致で検索する
+        book1 = self.create_book('ノルウェイの森', '村上 春樹')
+        book2 = self.create_book('森の生活', 'ソロー')
+
+        with mock.patch('backend.search.get_search_backend', return_value=None):
+            self.assertEqual(self.search('/api/v1/book/', 'ﾉﾙｳｪｲ'), [str(book1.id)])
+            self.assertEqual(self.search('/api/v1/book/', 'の森'), [str(book1.id)])
+            self.assertEqual(self.search('/api/v1/book/', '村上春樹'), [str(book1.id)])
+            self.assertEqual(self.search('/api/v1/book/', 'そろ'), [str(book2.id)])
+            # 1文字の検索語はインデックスの有無によらず前方一致
+            self.assertEqual(self.search('/api/v1/book/', '森'), [str(book2.id)])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQLの実行計画のみ確認する')
+class QueryPlanTests(APITestCase):
+    """主要なエンドポイントのクエリが、インデックスを使っていること"""
+
+    def test_uses_index(self):
+        # データ量が少なくてもインデックスの有無を判定できるよう、シーケンシャルスキャンを避けさせる
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        for name, table, queryset in get_queries():
+            with self.subTest(name=name):
+                plan = queryset.explain()
+                self.assertTrue(uses_index(plan, table), plan)
+
+
+class FakeUpstream():
+    """テスト用のupstream (volumesの情報を返し、問い合わせたIDをcallsに記録する)"""
+
+    volumes = {}
+    calls = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def fetch(self, ids):
+        FakeUpstream.calls.append(list(ids))
+        return {id_google: FakeUpstream.volumes.get(id_google) for id_google in ids}
+
+
+@override_settings(BOOK_METADATA={'UPSTREAM': 'apiv1.tests.FakeUpstream', 'TTL': 3600, 'NOT_FOUND_TTL': 60, 'WAIT_TIMEOUT': 5})
+class BookMetadataTests(APITestCase):
+    """Google Books APIの書籍情報のキャッシュ"""
+
+    def setUp(self):
+        FakeUpstream.volumes = {
+            'abcdefghijkl': {'title': '本', 'authors': ['著者'], 'thumbnail': None, 'page_count': 300, 'amazon_dp': '9784000000000'},
+        }
+        FakeUpstream.calls = []
+        self.service = BookMetadataService(upstream=FakeUpstream())
+
+    def test_ttl(self):
+        self.assertEqual(self.service.get('abcdefghijkl').title, '本')
+        self.assertEqual(self.service.get('abcdefghijkl').title, '本')
+        self.assertEqual(FakeUpstream.calls, [['abcdefghijkl']])
+
+        # TTLを過ぎたものは取得し直す
+        BookMetadata.objects.update(fetched_at=F('fetched_at') - timedelta(seconds=3601))
+        FakeUpstream.volumes['abcdefghijkl']['title'] = '新しい本'
+        self.assertEqual(self.service.get('abcdefghijkl').title, '新しい本')
+        self.assertEqual(len(FakeUpstream.calls), 2)
+
+    def test_not_found_ttl(self):
+        # 見つからなかったIDも記録し、NOT_FOUND_TTLの間は問い合わせない
+        self.assertIsNone(self.service.get('notfound0000'))
+        self.assertIsNone(self.service.get('notfound0000'))
+        self.assertEqual(FakeUpstream.calls, [['notfound0000']])
+
+        BookMetadata.objects.update(fetched_at=F('fetched_at') - timedelta(seconds=61))
+        self.assertIsNone(self.service.get('notfound0000'))
+        self.assertEqual(len(FakeUpstream.calls), 2)
+
+    def test_invalid_id(self):
+        self.assertIsNone(self.service.get('../volumes'))
+        self.assertEqual(FakeUpstream.calls, [])
+
+    def test_lru_eviction(self):
+        now = timezone.now()
+        for i, id_google in enumerate(['old000000000', 'middle000000', 'new000000000']):
+            BookMetadata.objects.create(id_google=id_google, title=id_google, fetched_at=now, last_accessed_at=now - timedelta(days=3 - i))
+
+        # 取得したものは最終アクセス日時が更新され、削除されない
+        self.assertEqual(self.service.get('old000000000').title, 'old000000000')
+        self.assertEqual(BookMetadata.objects.evict(2), 1)
+        self.assertEqual(set(BookMetadata.objects.values_list('pk', flat=True)), {'old000000000', 'new000000000'})
+
+    def test_schedule_eviction(self):
+        with self.settings(BOOK_METADATA={'UPSTREAM': 'apiv1.tests.FakeUpstream', 'MAX_ENTRIES': 10}):
+            with mock.patch('backend.metadata.run_in_background') as run_in_background:
+                self.service.get('abcdefghijkl')
+        run_in_background.assert_called_once_with(BookMetadata.objects.evict, 10, name='evict_book_metadata')
+
+    def test_wait_pending(self):
+        # 取得中の書籍を別のスレッドが要求した場合は、upstreamに問い合わせずに先の取得の結果を待つ
+        results = {}
+
+        def fetch_other():
+            results.update(self.service._fetch(['abcdefghijkl'], timezone.now()))
+
+        def fetch(ids):
+            thread = threading.Thread(target=fetch_other)
+            thread.start()
+            thread.join(timeout=0.5)
+            self.assertTrue(thread.is_alive())
+            fetch.thread = thread
+            return FakeUpstream().fetch(ids)
+
+        with mock.patch.object(self.service.upstream, 'fetch', side_effect=fetch):
+            metadata = self.service.get('abcdefghijkl')
+        fetch.thread.join()
+
+        self.assertEqual(FakeUpstream.calls, [['abcdefghijkl']])
+        self.assertEqual(results['abcdefghijkl'], metadata)
+        self.assertEqual(self.service._pending, {})
+
+    def test_wait_timeout(self):
+        with self.settings(BOOK_METADATA={'UPSTREAM': 'apiv1.tests.FakeUpstream', 'WAIT_TIMEOUT': 0.1}):
+            self.service._pending['abcdefghijkl'] = Future()
+            self.assertIsNone(self.service.get('abcdefghijkl'))
+        self.assertEqual(FakeUpstream.calls, [])
+
+    def test_upstream_error(self):
+        # 取得に失敗した場合は、期限の切れたキャッシュを使う
+        upstream = GoogleBooksUpstream()
+        service = BookMetadataService(upstream=upstream)
+        now = timezone.now()
+        BookMetadata.objects.create(id_google='stale0000000', title='古い本', fetched_at=now - timedelta(days=1), last_accessed_at=now)
+
+        for error in (requests.Timeout(), requests.ConnectionError()):
+            with self.subTest(error=error), mock.patch.object(upstream.session, 'get', side_effect=error):
+                with self.assertLogs('backend.metadata', 'WARNING'):
+                    self.assertEqual(service.get('stale0000000').title, '古い本')
+                    self.assertIsNone(service.get('abcdefghijkl'))
+
+        with mock.patch.object(upstream, 'fetch', side_effect=RuntimeError), self.assertLogs('backend.metadata', 'ERROR'):
+            self.assertEqual(service.get('stale0000000').title, '古い本')
+
+
+@override_settings(BOOK_METADATA={'UPSTREAM': 'apiv1.tests.FakeUpstream'})
+class BookCreateTests(APITestCase):
+    """書籍の登録 (Google Booksの情報で不足したフィールドを補う)"""
+
+    def setUp(self):
+        FakeUpstream.volumes = {
+            'abcdefghijkl': {'title': '本', 'authors': ['著者'], 'thumbnail': None, 'page_count': 300, 'amazon_dp': '9784000000000'},
+        }
+        FakeUpstream.calls = []
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        self.client.force_authenticate(self.user)
+
+    def test_fill_missing_fields(self):
+        res = self.client.post('/api/v1/book/', {'id_google': 'abcdefghijkl', 'title': '独自の書名'}, format='json')
+        self.assertEqual(res.status_code, 201)
+
+        # 送られたフィールドはそのまま使い、不足したフィールドだけを補う
+        book = Book.objects.get(created_by=self.user, id_google='abcdefghijkl')
+        self.assertEqual((book.title, book.total, book.amazon_dp), ('独自の書名', 300, '9784000000000'))
+        self.assertEqual([author.name for author in book.authors.all()], ['著者'])
+
+    def test_complete_data(self):
+        data = {'id_google': 'abcdefghijkl', 'title': '本', 'authors': ['著者'], 'thumbnail': None, 'amazon_dp': None, 'total': 100}
+        self.assertEqual(self.client.post('/api/v1/book/', data, format='json').status_code, 201)
+        self.assertEqual(FakeUpstream.calls, [])
+
+    def test_upstream_error(self):
+        # Google Booksから取得できない場合は、送られたデータのみで登録する
+        data = {'id_google': 'abcdefghijkl', 'title': '本', 'authors': ['著者'], 'total': 100}
+        with self.settings(BOOK_METADATA={'UPSTREAM': 'backend.metadata.GoogleBooksUpstream'}):
+            with mock.patch('requests.Session.get', side_effect=requests.Timeout), self.assertLogs('backend.metadata', 'WARNING'):
+                res = self.client.post('/api/v1/book/', data, format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['total'], 100)
+
+        # 必須のフィールドが不足していれば、バリデーションのエラーになる
+        with self.settings(BOOK_METADATA={'UPSTREAM': 'backend.metadata.GoogleBooksUpstream'}):
+            with mock.patch('requests.Session.get', side_effect=requests.Timeout), self.assertLogs('backend.metadata', 'WARNING'):
+                res = self.client.post('/api/v1/book/', {'id_google': 'mnopqrstuvwx'}, format='json')
+        self.assertEqual(res.status_code, 400)
+
+    def test_update(self):
+        # 既存の書籍は、Google Books IDの形式によらず更新できる
+        book = Book.objects.create(id_google='isbn:9784000', title='本', total=300, created_by=self.user)
+        res = self.client.patch(f'/api/v1/book/{book.id}/', {'title': '新しい書名'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        res = self.client.put(f'/api/v1/book/{book.id}/', {'id_google': book.id_google, 'title': '本', 'authors': ['著者'], 'total': 300}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(FakeUpstream.calls, [])
+
+
+class ExportTests(APITestCase):
+    """読書記録のエクスポート (NDJSON・CSV)"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        create_books(self.user, 3)
+        create_books(CustomUser.objects.create_user('other', 'other@example.com'), 2)
+
+        # 読んだ後に積読に戻した本
+        self.book = Book.objects.create(id_google='tobereadbook', title='積読', total=300, created_by=self.user)
+        StatusLog.objects.create(book=self.book, position=100, created_at=timezone.now() - timedelta(days=1), created_by=self.user)
+        StatusLog.objects.create(book=self.book, position=0, created_by=self.user)
+
+        self.client.force_authenticate(self.user)
+
+    def export(self, **params):
+        res = self.client.get('/api/v1/export/', params)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        return b''.join(res.streaming_content).decode('utf-8'), res
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_ndjson(self):
+        content, res = self.export(resource='books,status,notes')
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([line['type'] for line in lines], ['books'] * 4 + ['status'] * 11 + ['notes'] * 9)
+
+        # 書籍の進捗は一覧のAPIと同じ (積読に戻した本は直前の進捗の位置)
+        books = {line['data']['id']: line['data'] for line in lines if line['type'] == 'books'}
+        for item in self.client.get('/api/v1/book/').data['results']:
+            self.assertEqual(books[item['id']]['progress'], item['progress'])
+        self.assertEqual(books[str(self.book.id)]['progress']['position']['value'], 100)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_csv(self):
+        content, res = self.export(output='csv', resource='status')
+        self.assertEqual(res['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment;', res['Content-Disposition'])
+
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 11)
+        self.assertEqual({row['book'] for row in rows}, {str(book.id) for book in Book.objects.filter(created_by=self.user)})
+        self.assertEqual(sorted(int(row['position_value']) for row in rows if row['book'] == str(self.book.id)), [100, 100])
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get('/api/v1/export/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/export/', {'resource': 'users'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/export/', {'output': 'csv', 'resource': 'books,status'}).status_code, 400)
+
+
+class BookImportTests(APITestCase):
+    """書籍のステータスの履歴ごとの一括登録"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        self.book = Book.objects.create(id_google='existing0000', title='登録済み', total=300, created_by=self.user)
+        self.client.force_authenticate(self.user)
+
+    def make_row(self, i, **kwargs):
+        return {'id_google': f'import{i:06d}', 'title': f'インポート {i}', 'authors': [f'著者 {i}'], 'total': 300, **kwargs}
+
+    def test_import(self):
+        yesterday = (timezone.now() - timedelta(days=1)).isoformat()
+        rows = [
+            self.make_row(0, status=[{'position': 100, 'created_at': yesterday}, {'position': 300}]),
+            self.make_row(1, title=''),
+            self.make_row(2, id_google='existing0000'),
+            self.make_row(3, status=[{'position': 50}]),
+            self.make_row(4, id_google='import000003'),
+            self.make_row(5, status=[{'position': 400}]),
+        ]
+        res = self.client.post('/api/v1/book/import/', rows, format='json')
+        self.assertEqual(res.status_code, 201)
+
+        # 形式の不正な行はエラー、登録済み・同じリクエスト内で重複したGoogle Books IDの行はスキップする
+        created = {item['index']: item['id'] for item in res.data['created']}
+        self.assertEqual(sorted(created), [0, 3])
+        self.assertEqual(res.data['skipped'], [{'index': 2, 'id': str(self.book.id)}, {'index': 4, 'id': created[3]}])
+        self.assertEqual([item['index'] for item in res.data['errors']], [1, 5])
+
+        # ステータスの履歴から読書状態・日毎の集計・検索インデックスを更新する
+        book = Book.objects.get(pk=created[0])
+        self.assertEqual((book.state, book.current_position), ('read', 300))
+        self.assertEqual([author.name for author in book.authors.all()], ['著者 0'])
+        self.assertEqual(Book.objects.get(pk=created[3]).state, 'reading')
+        self.assertEqual(sum(DailyReadingStats.objects.filter(user=self.user).values_list('pages', flat=True)), 350)
+        self.assertEqual(self.client.get('/api/v1/book/', {'q': 'インポート'}).data['count'], 2)
+
+        res = self.client.post('/api/v1/book/import/', rows[:1], format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['skipped'], [{'index': 0, 'id': created[0]}])
+
+    def test_constant_queries(self):
+        # 行数によらずクエリ数は一定 (まとめて登録する)
+        counts = []
+        for start, count in ((0, 2), (100, 30)):
+            rows = [self.make_row(start + i, status=[{'position': 100}, {'position': 200}]) for i in range(count)]
+            with CaptureQueriesContext(connection) as context:
+                res = self.client.post('/api/v1/book/import/', rows, format='json')
+            self.assertEqual(len(res.data['created']), count)
+            counts.append(len(context))
+
+        self.assertEqual(counts[0], counts[1])
+
+    @override_settings(IMPORT_MAX_ROWS=2)
+    def test_invalid_payload(self):
+        self.assertEqual(self.client.post('/api/v1/book/import/', {'id_google': 'import000000'}, format='json').status_code, 400)
+        rows = [self.make_row(i) for i in range(3)]
+        self.assertEqual(self.client.post('/api/v1/book/import/', rows, format='json').status_code, 400)
+        self.assertFalse(Book.objects.filter(id_google__startswith='import').exists())
+
+
+class StatusLogBatchTests(APITestCase):
+    """ステータスの一括登録 (オフライン時に溜めた更新の同期)"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('reader', 'reader@example.com')
+        self.other = CustomUser.objects.create_user('other', 'other@example.com')
+        self.book = Book.objects.create(id_google='000000000001', title='本', total=300, created_by=self.user)
+        self.other_book = Book.objects.create(id_google='000000000002', title='本', total=300, created_by=self.other)
+        self.client.force_authenticate(self.user)
+
+    def batch(self, items):
+        return self.client.post('/api/v1/status/batch/', items, format='json')
+
+    def test_idempotent(self):
+        items = [
+            {'id': str(uuid.uuid4()), 'book': str(self.book.id), 'position': 100, 'created_at': (timezone.now() - timedelta(days=1)).isoformat()},
+            {'id': str(uuid.uuid4()), 'book': str(self.book.id), 'position': 200},
+        ]
+        res = self.batch(items)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual([result['result'] for result in res.data['results']], ['created', 'created'])
+        self.assertEqual([result['id'] for result in res.data['results']], [item['id'] for item in items])
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.current_position, self.book.state), (200, 'reading'))
+
+        # 同じIDの再送は登録せずにスキップする
+        res = self.batch(items)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result['result'] for result in res.data['results']], ['skipped', 'skipped'])
+        self.assertEqual(StatusLog.objects.filter(book=self.book).count(), 2)
+
+    def test_errors(self):
+        other_status = StatusLog.objects.create(book=self.other_book, position=100, created_by=self.other)
+        res = self.batch([
+            {'book': str(self.book.id), 'position': 100},
+            {'id': str(other_status.id), 'book': str(self.book.id), 'position': 100},
+            {'book': str(self.other_book.id), 'position': 100},
+            {'book': str(self.book.id), 'position': 301},
+            {'book': str(self.book.id), 'position': -1},
+            {'book': 'xxx', 'position': 100},
+        ])
+        self.assertEqual(res.status_code, 201)
+
+        # 他のユーザーのステータスのIDは、存在を明かさずにエラーにする
+        results = res.data['results']
+        self.assertEqual(results[0]['result'], 'created')
+        self.assertEqual(results[1]['errors'], {'id': ['このIDは使用できません。']})
+        self.assertIn('book', results[2]['errors'])
+        self.assertIn('position', results[3]['errors'])
+        self.assertIn('position', results[4]['errors'])
+        self.assertIn('book', results[5]['errors'])
+        self.assertEqual(StatusLog.objects.get(pk=other_status.pk).created_by, self.other)
+
+    def test_id_race(self):
+        # 確認後に同じIDのステータスが登録された場合は、項目ごとに結果を返す
+        own_id, other_id, new_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        bulk_record = StatusLog.objects.bulk_record
+
+        def record(user, status_log):
+            if not StatusLog.objects.filter(pk__in=[own_id, other_id]).exists():
+                StatusLog.objects.create(id=own_id, book=self.book, position=50, created_by=self.user)
+                StatusLog.objects.create(id=other_id, book=self.other_book, position=50, created_by=self.other)
+            return bulk_record(user, status_log)
+
+        items = [{'id': str(status_id), 'book': str(self.book.id), 'position': 100} for status_id in (own_id, other_id, new_id)]
+        with mock.patch.object(StatusLog.objects, 'bulk_record', side_effect=record):
+            res = self.batch(items)
+
+        results = res.data['results']
+        self.assertEqual(results[0], {'index': 0, 'id': str(own_id), 'result': 'skipped'})
+        self.assertEqual(results[1]['errors'], {'id': ['このIDは使用できません。']})
+        self.assertEqual(results[2], {'index': 2, 'id': str(new_id), 'result': 'created'})
+
+    @override_settings(STATUS_BATCH_MAX_ITEMS=2)
+    def test_invalid_payload(self):
+        self.assertEqual(self.batch({'book': str(self.book.id), 'position': 100}).status_code, 400)
+        self.assertEqual(self.batch([{'book': str(self.book.id), 'position': 100}] * 3).status_code, 400)
+        self.assertFalse(StatusLog.objects.exists())
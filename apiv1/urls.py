@@ -12,7 +12,10 @@ app_name = 'apiv1'
 urlpatterns = [
     path('', include(router.urls)),
     path('analytics/', views.AnalyticsAPIView.as_view()),
+    path('dashboard/', views.DashboardAPIView.as_view()),
     path('author/', views.AuthorListAPIView.as_view()),
     path('pages/', views.PagesDailyAPIView.as_view()),
+    path('export/', views.ExportAPIView.as_view()),
+    path('profiling/', views.ProfilingStatsAPIView.as_view()),
     path('inquiry/', views.InquiryCreateAPIView.as_view())
 ]
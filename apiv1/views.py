@@ -1,16 +1,30 @@
 from time import time
 from urllib.request import Request
 from rest_framework import status, viewsets, pagination, response, views, generics
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from django_filters import rest_framework as django_filter
+from django_filters.constants import EMPTY_VALUES
 from datetime import date, timedelta, datetime as dt
-from django.utils.timezone import localtime
+from django.utils.timezone import localtime, localdate
+from django.http import QueryDict, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework.parsers import FileUploadParser, FormParser
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 
-from backend.models import Book, Note, StatusLog, Author
-from .serializers import AuthorSerializer, BookSerializer, NoteSerializer, StatusLogSerializer, AnalyticsSerializer, PagesDailySerializer, InquirySerializer
+from backend.metadata import book_metadata, is_valid_id_google
+from backend.profiling import endpoint_stats
+from backend.models import Book, Note, StatusLog, Author, AuthorSummary, DailyReadingStats, prefetch_author_relations
+from .serializers import AuthorSerializer, AuthorSummarySerializer, BookSerializer, BookSummarySerializer, NoteSerializer, StatusLogSerializer, AnalyticsSerializer, PagesDailySerializer, InquirySerializer
 from .filters import BookFilter, StatusLogFilter, NoteFilter
+from .cache import cache_per_user
+from .pagination import TimelineListMixin
+from .dashboard import get_dashboard, get_dashboard_etag
+from .export import EXPORT_RESOURCES, EXPORT_FORMATS, export_ndjson, export_csv
+from .importer import import_books, record_status_log
 
 
 class CustomPageNumberPagination(pagination.PageNumberPagination):
@@ -49,34 +63,109 @@ class BookViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # プライベートアクセスのみ
-        return Book.objects.filter(created_by=self.request.user).sort_by_accessed_at()
+        queryset = Book.objects.filter(created_by=self.request.user).sort_by_accessed_at().prefetch_authors()
+
+        if self.action == 'list':
+            # 一覧では現在の進捗のみを返し、履歴・メモはexpandで指定された場合のみ取得する
+            expand = self.get_expand()
+            queryset = queryset.annotate_progress_position()
+        else:
+            expand = ('status', 'note')
+
+        if 'status' in expand:
+            queryset = queryset.prefetch_status_log()
+        if 'note' in expand:
+            queryset = queryset.prefetch_notes()
+
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return BookSummarySerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'expand': self.get_expand()}
+
+    def get_expand(self):
+        """一覧で展開するフィールドを取得 (?expand=status,note)"""
+
+        expand = self.request.GET.get('expand', '')
+        return tuple(field for field in expand.split(',') if field in ('status', 'note'))
+
+    def get_create_data(self, request, id_google):
+        """登録する書籍のデータ (指定されなかった書名・著者・表紙・ページ数などは、Google Booksの情報のキャッシュから補う)"""
+
+        data = request.data
+        try:
+            format_type = int(data.get('format_type', 0))
+        except (TypeError, ValueError):
+            format_type = 0
+
+        fields = ('title', 'authors', 'thumbnail', 'amazon_dp', 'total_page' if format_type == 1 else 'total')
+        if all(field in data for field in fields):
+            return data
+
+        metadata = book_metadata.get(id_google)
+        if metadata is None:
+            return data
+
+        data = data.copy()
+        for field, value in metadata.get_book_data(format_type).items():
+            if field in data:
+                continue
+            if field == 'authors' and isinstance(data, QueryDict):
+                data.setlist(field, value)
+            else:
+                data[field] = value
+
+        return data
 
     def create(self, request, *args, **kwargs):
-        # すでに同一のGoogle Books IDで登録されたレコードが存在する場合、保存せずにそのまま返す
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        # Google Booksに問い合わせられない形式のIDは、先に送られたデータのみで検証する (登録時も情報は補わない)
+        id_google = request.data.get('id_google')
+        if not is_valid_id_google(id_google):
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            id_google = serializer.validated_data['id_google']
 
-        book = Book.objects.filter(created_by=request.user, id_google=serializer.validated_data['id_google'])
+        # すでに同一のGoogle Books IDで登録されたレコードが存在する場合、保存せずにそのまま返す
+        book = Book.objects.filter(created_by=request.user, id_google=id_google)
 
         if book.exists():
             serializer = BookSerializer(book.first())
             return response.Response(serializer.data, status.HTTP_200_OK)
-        else:
-            serializer.save()
-            return response.Response(serializer.data, status.HTTP_201_CREATED)
 
-    def destroy(self, request, *args, **kwargs):
-        # perform destroy
-        instance = self.get_object()
-        self.perform_destroy(instance)
+        serializer = self.get_serializer(data=self.get_create_data(request, id_google))
+        serializer.is_valid(raise_exception=True)
 
-        # orphanedなAuthorオブジェクトを削除
-        Author.objects.filter(books=None).delete()
+        try:
+            with transaction.atomic():
+                self.perform_create(serializer)
+        except IntegrityError:
+            # 同時に同じ書籍が登録された場合 (created_by, id_google の一意制約)
+            if not book.exists():
+                raise
+            serializer = BookSerializer(book.first())
+            return response.Response(serializer.data, status.HTTP_200_OK)
 
-        return response.Response(status=status.HTTP_204_NO_CONTENT)
+        return response.Response(serializer.data, status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """書籍をステータスの履歴ごと一括登録 (Google Books IDが登録済みの書籍はスキップ)"""
 
-class StatusLogViewSet(viewsets.ModelViewSet):
+        rows = request.data
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValidationError('書籍のリストを指定してください。')
+        if len(rows) > settings.IMPORT_MAX_ROWS:
+            raise ValidationError(f'一度に登録できる書籍は{settings.IMPORT_MAX_ROWS}件までです。')
+
+        result = import_books(request.user, rows)
+        return response.Response(result, status.HTTP_201_CREATED if result['created'] else status.HTTP_200_OK)
+
+
+class StatusLogViewSet(TimelineListMixin, viewsets.ModelViewSet):
     """StatusLogのCRUD用APIクラス"""
 
     queryset = StatusLog.objects.none()
@@ -88,15 +177,26 @@ class StatusLogViewSet(viewsets.ModelViewSet):
     pagination_class = CustomPageNumberPagination
 
     def get_queryset(self):
-        # ページネーションなしのオプションの場合
-        if self.request.GET.get('no_pagination'):
-            self.pagination_class = None
-
         # プライベートアクセスのみ
-        return StatusLog.objects.filter(created_by=self.request.user).select_related('book')
+        return StatusLog.objects.filter(created_by=self.request.user).select_related('book') \
+            .prefetch_related(prefetch_author_relations('book__bookauthorrelation_set')).annotate_prev_position()
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """ステータスを一括登録 (オフライン時に溜めた更新の同期用)"""
+
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError('ステータスのリストを指定してください。')
+        if len(items) > settings.STATUS_BATCH_MAX_ITEMS:
+            raise ValidationError(f'一度に登録できるステータスは{settings.STATUS_BATCH_MAX_ITEMS}件までです。')
+
+        results = record_status_log(request.user, items)
+        is_created = any(result.get('result') == 'created' for result in results)
+        return response.Response({'results': results}, status.HTTP_201_CREATED if is_created else status.HTTP_200_OK)
 
 
-class NoteViewSet(viewsets.ModelViewSet):
+class NoteViewSet(TimelineListMixin, viewsets.ModelViewSet):
     """NoteのCRUD用APIクラス"""
 
     queryset = Note.objects.none()
@@ -109,27 +209,46 @@ class NoteViewSet(viewsets.ModelViewSet):
     pagination_class = CustomPageNumberPagination
 
     def get_queryset(self):
-        # ページネーションなしのオプションの場合
-        if self.request.GET.get('no_pagination'):
-            self.pagination_class = None
-
         # プライベートアクセスのみ
-        return Note.objects.filter(created_by=self.request.user).select_related('book')
+        return Note.objects.filter(created_by=self.request.user).select_related('book') \
+            .prefetch_related(prefetch_author_relations('book__bookauthorrelation_set'))
 
 
 class AnalyticsAPIView(views.APIView):
     """分析用のAPIクラス"""
 
+    @cache_per_user
     def get(self, request, *args, **kwargs):
         queryset = StatusLog.objects.filter(created_by=request.user, position__gt=0).select_related('book')
         filterset = StatusLogFilter(request.query_params, queryset=queryset)
         if not filterset.is_valid():
             raise ValidationError(filterset.errors)
 
-        serializer = AnalyticsSerializer(filterset.qs, context={'request': request, 'filterset': filterset})
+        context = {'request': request, 'filterset': filterset}
+        if filterset.has_only_date_range():
+            # 日付範囲のみの場合、日毎の集計から求める
+            context['daily_stats'] = DailyReadingStats.objects.filter(user=request.user)
+
+        serializer = AnalyticsSerializer(filterset.qs, context=context)
         return response.Response(serializer.data, status.HTTP_200_OK)
 
 
+class DashboardAPIView(views.APIView):
+    """ホーム画面のダッシュボード用API (If-None-Matchが現在のETagと一致する場合は集計せずに304を返す)"""
+
+    def get(self, request):
+        etag = quote_etag(get_dashboard_etag(request.user))
+        res = get_conditional_response(request, etag=etag)
+        if res is None:
+            res = response.Response(get_dashboard(request))
+
+        # ブラウザには保存させ、毎回ETagで再検証させる
+        res['ETag'] = etag
+        patch_cache_control(res, private=True, no_cache=True)
+        patch_vary_headers(res, ['Authorization'])
+        return res
+
+
 class AuthorListAPIView(generics.ListAPIView):
     """著者名リストのAPI"""
 
@@ -141,10 +260,38 @@ class AuthorListAPIView(generics.ListAPIView):
 
     pagination_class = AuthorPagination
 
+    @cache_per_user
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_serializer_class(self):
+        if getattr(self, 'use_summary', False):
+            return AuthorSummarySerializer
+        return super().get_serializer_class()
+
+    def get_summary_queryset(self):
+        """絞り込みがない (または読書状態のみの) 場合、著者の集計から取得するquerysetを返す"""
+
+        filterset = BookFilter(self.request.query_params, queryset=Book.objects.none(), request=self.request)
+        if not filterset.is_valid():
+            return None
+
+        params = {name: value for name, value in filterset.form.cleaned_data.items() if value not in EMPTY_VALUES}
+        if len(params) > 1 or not {*params} <= {'state', 'state_not'}:
+            return None
+
+        return AuthorSummary.objects.filter(user=self.request.user).sort_by_books_count(
+            state=params.get('state') or params.get('state_not'), exclude='state_not' in params
+        )
+
     def list(self, request, *args, **kwargs):
-        # Booksをフィルタリングして、条件に合致するAuthorのquerysetを取得
-        books = self.filter_queryset(Book.objects.filter(created_by=request.user))
-        queryset = Author.objects.filter(books__in=books, bookauthorrelation__order=0).sort_by_books_count()
+        queryset = self.get_summary_queryset()
+        self.use_summary = queryset is not None
+
+        if queryset is None:
+            # Booksをフィルタリングして、条件に合致するAuthorのquerysetを取得
+            books = self.filter_queryset(Book.objects.filter(created_by=request.user))
+            queryset = Author.objects.filter(books__in=books, bookauthorrelation__order=0).sort_by_books_count()
 
         if not self.request.GET.get('no_pagination'):
             page = self.paginate_queryset(queryset)
@@ -157,8 +304,9 @@ class AuthorListAPIView(generics.ListAPIView):
 
 
 class PagesDailyAPIView(views.APIView):
-    """日毎のページ数を集計するAPI"""
+    """日毎 (週毎・月毎) のページ数を集計するAPI"""
 
+    @cache_per_user
     def get(self, request: Request):
         queryset = StatusLog.objects.filter(created_by=request.user, position__gt=0).select_related('book')
         filterset = StatusLogFilter(request.query_params, queryset=queryset)
@@ -167,14 +315,56 @@ class PagesDailyAPIView(views.APIView):
         if not filterset.is_valid():
             raise ValidationError(filterset.errors)
 
-        # 日付リストを作成
-        date_set = set(queryset.values_list('created_at__date', flat=True))
-        date_list = sorted(list(date_set), reverse=True)
+        # 集計単位 (日・週・月)
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in ('day', 'week', 'month'):
+            raise ValidationError({'granularity': 'day, week, monthのいずれかを指定してください。'})
 
-        serializer = PagesDailySerializer(date_list, many=True, context={'queryset': queryset})
+        serializer = PagesDailySerializer(queryset.sum_pages_by_date(granularity), many=True)
         return response.Response(serializer.data)
 
 
+class ExportAPIView(views.APIView):
+    """読書記録のエクスポート用API (?output=ndjson|csv&resource=books,authors,status,notes)"""
+
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': 'ndjson, csvのいずれかを指定してください。'})
+
+        resources = [_ for _ in request.query_params.get('resource', '').split(',') if _] or list(EXPORT_RESOURCES)
+        if any(_ not in EXPORT_RESOURCES for _ in resources):
+            raise ValidationError({'resource': 'books, authors, status, notesから指定してください。'})
+
+        if output == 'csv':
+            # CSVは1ファイルにつき1リソースのみ
+            if len(resources) != 1:
+                raise ValidationError({'resource': 'CSVの場合はリソースを1つだけ指定してください。'})
+            content = export_csv(resources[0], request.user)
+            content_type = 'text/csv; charset=utf-8'
+        else:
+            content = export_ndjson(resources, request.user)
+            content_type = 'application/x-ndjson'
+
+        filename = 'yomlog-{}-{}.{}'.format('-'.join(resources), localdate().strftime('%Y%m%d'), output)
+        res = StreamingHttpResponse(content, content_type=content_type)
+        res['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return res
+
+
+class ProfilingStatsAPIView(views.APIView):
+    """エンドポイントごとの直近の処理時間を返すAPI (スタッフのみ、プロセスごとの集計)"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return response.Response(endpoint_stats.summary())
+
+    def delete(self, request):
+        endpoint_stats.clear()
+        return response.Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class InquiryCreateAPIView(generics.CreateAPIView):
     """お問い合わせメール送信用API"""
 
@@ -2,14 +2,13 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from djoser.serializers import UserSerializer, UserCreatePasswordRetypeSerializer
 from djoser.conf import settings as djoser_settings
-from datetime import date, timedelta
 
 from apiv1.mixins import ImageSerializerMixin
-from apiv1.serializers import AnalyticsSerializer, BookSerializer, AuthorSerializer, PagesDailySerializer
-from backend.models import StatusLog, Book, Author
+from apiv1.dashboard import get_dashboard
+from backend.profiling import ProfilingSerializerMixin
 
 
-class CustomUserSerializer(UserSerializer, ImageSerializerMixin):
+class CustomUserSerializer(ProfilingSerializerMixin, UserSerializer, ImageSerializerMixin):
     fullname = serializers.SerializerMethodField()
     avatar_thumbnail = serializers.SerializerMethodField()
     analytics = serializers.SerializerMethodField()
@@ -38,31 +37,19 @@ class CustomUserSerializer(UserSerializer, ImageSerializerMixin):
     def get_avatar_thumbnail(self, instance):
         return self._get_thumbnail(instance)
 
+    def get_fields(self):
+        fields = super().get_fields()
+
+        # 分析のデータは ?include=analytics を指定した場合のみ返す (ダッシュボードは /api/v1/dashboard/ から取得)
+        request = self.context.get('request')
+        include = request.query_params.get('include', '').split(',') if request is not None else []
+        if 'analytics' not in include:
+            fields.pop('analytics', None)
+
+        return fields
+
     def get_analytics(self, instance):
-        status_log = StatusLog.objects.filter(created_by=instance, position__gt=0).select_related('book')
-        analytics = AnalyticsSerializer(status_log, context={**self.context}).data
-
-        # recent_booksの先頭5件を取得
-        books = Book.objects.filter(created_by=instance).sort_by_accessed_at()[:5]
-        recent_books = BookSerializer(books, many=True, context={'inside': True}).data
-
-        # authors_countの先頭8件を取得
-        user = self.context['request'].user
-        authors = Author.objects.filter(books__created_by=user, bookauthorrelation__order=0).sort_by_books_count()[:6]
-        authors_count = AuthorSerializer(authors, many=True).data
-
-        # 直近一週間に読んだページ数を取得
-        status_weekly = status_log.filter(created_at__gte=date.today() - timedelta(days=7))
-        date_set = set(status_weekly.values_list('created_at__date', flat=True))
-        date_list = sorted(list(date_set), reverse=True)
-        pages_daily = PagesDailySerializer(date_list, many=True, context={'queryset': status_weekly}).data
-
-        return {
-            **analytics,
-            'recent_books': recent_books,
-            'authors_count': authors_count,
-            'pages_daily': pages_daily
-        }
+        return get_dashboard(self.context['request'])
 
 
 class CustomUserListSerializer(CustomUserSerializer):
@@ -1,7 +1,7 @@
 from rest_framework_simplejwt import token_blacklist
 from django.contrib import admin
 
-from backend.models import Author, Book, StatusLog, Note, BookAuthorRelation, CustomUser
+from backend.models import Author, AuthorSummary, Book, StatusLog, Note, BookAuthorRelation, CustomUser, DailyReadingStats, SearchDocument
 
 
 class BookAuthorRelationInline(admin.TabularInline):
@@ -12,10 +12,41 @@ class BookAuthorRelationInline(admin.TabularInline):
 class BookAuthorRelationAdmin(admin.ModelAdmin):
     inlines = (BookAuthorRelationInline,)
 
+    def save_related(self, request, form, formsets, change):
+        prev_author_ids = set(form.instance.bookauthorrelation_set.values_list('author_id', flat=True)) if change else set()
+        super().save_related(request, form, formsets, change)
+        # 著者の変更を検索用インデックス・著者の集計に反映し、紐付けが外れた著者を削除待ちにする
+        SearchDocument.objects.index_book(form.instance, fields=['authors'])
+        author_ids = set(form.instance.bookauthorrelation_set.values_list('author_id', flat=True))
+        AuthorSummary.objects.refresh(form.instance.created_by, prev_author_ids | author_ids)
+        Author.objects.mark_for_cleanup(prev_author_ids)
+
+    def delete_queryset(self, request, queryset):
+        # 一括削除後に日毎の集計・著者の集計を再計算し、著者を削除待ちにする
+        user_ids = list(queryset.values_list('created_by', flat=True).distinct())
+        author_ids = list(BookAuthorRelation.objects.filter(book__in=queryset).values_list('author_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for user in CustomUser.objects.filter(id__in=user_ids):
+            DailyReadingStats.objects.rebuild(user)
+            AuthorSummary.objects.rebuild(user)
+        Author.objects.mark_for_cleanup(author_ids)
+
+
+class StatusLogAdmin(admin.ModelAdmin):
+
+    def delete_queryset(self, request, queryset):
+        # 一括削除後に書籍の読書状態と日毎の集計を再計算する
+        book_ids = list(queryset.values_list('book_id', flat=True).distinct())
+        user_ids = list(queryset.values_list('created_by', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        Book.objects.filter(id__in=book_ids).refresh_reading_state()
+        for user in CustomUser.objects.filter(id__in=user_ids):
+            DailyReadingStats.objects.rebuild(user)
+
 
 admin.site.register(Book, BookAuthorRelationAdmin)
 admin.site.register(Note)
-admin.site.register(StatusLog)
+admin.site.register(StatusLog, StatusLogAdmin)
 admin.site.register(Author)
 
 admin.site.register(CustomUser)
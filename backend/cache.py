@@ -0,0 +1,53 @@
+"""
+ユーザーごとのキャッシュのバージョン
+
+APIレスポンスのキャッシュ (apiv1.cache) のキーに含め、書き込み時に更新して古いキャッシュを無効化する。
+バージョンはビューではなくモデルの保存・削除や集計の再計算から更新するため、
+管理画面・管理コマンド・バックグラウンドタスクなど、API以外からデータを更新した場合も無効化される。
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+import time
+
+
+def _get_version_key(user):
+    # userはユーザーまたはそのID
+    return 'user_cache_version:{}'.format(getattr(user, 'pk', user))
+
+
+def get_user_cache_version(user):
+    """ユーザーのキャッシュのバージョンを取得"""
+
+    key = _get_version_key(user)
+    version = cache.get(key)
+    if version is None:
+        # 退避されたバージョンを再利用しないよう、初期値には現在時刻を使う
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_user_cache_version(user):
+    """ユーザーのキャッシュのバージョンを更新 (古いキャッシュを無効化)"""
+
+    if user is None or getattr(user, 'is_anonymous', False):
+        return
+
+    try:
+        cache.incr(_get_version_key(user))
+    except ValueError:
+        cache.set(_get_version_key(user), time.time_ns(), None)
+
+
+def bump_user_cache_version_on_commit(user):
+    """
+    トランザクションのコミット後に、ユーザーのキャッシュのバージョンを更新
+    (コミット前に更新すると、他のリクエストがコミット前のデータを新しいバージョンでキャッシュしてしまうため)
+    """
+
+    if user is None:
+        return
+
+    transaction.on_commit(lambda: bump_user_cache_version(user))
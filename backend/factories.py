@@ -0,0 +1,89 @@
+"""
+テスト・ベンチマーク用のデータを作成するファクトリ (factory_boy)
+"""
+
+from django.utils import timezone
+import factory
+from factory import fuzzy
+from factory.django import DjangoModelFactory
+from datetime import timedelta
+
+from .models import Author, Book, BookAuthorRelation, CustomUser, DailyReadingStats, Note, SearchDocument, StatusLog
+
+
+class UserFactory(DjangoModelFactory):
+    class Meta:
+        model = CustomUser
+        django_get_or_create = ('username',)
+
+    username = factory.Sequence(lambda n: f'user{n}')
+    email = factory.LazyAttribute(lambda o: f'{o.username}@example.com')
+
+
+class AuthorFactory(DjangoModelFactory):
+    class Meta:
+        model = Author
+
+    name = factory.Faker('name', locale='ja_JP')
+
+
+class BookFactory(DjangoModelFactory):
+    class Meta:
+        model = Book
+
+    id_google = factory.Sequence(lambda n: f'{n:012d}')
+    title = factory.Faker('text', max_nb_chars=40, locale='ja_JP')
+    format_type = fuzzy.FuzzyChoice([0, 1])
+    total = fuzzy.FuzzyInteger(100, 5000)
+    total_page = factory.LazyAttribute(lambda o: fuzzy.FuzzyInteger(100, 500).fuzz() if o.format_type == 1 else None)
+    created_at = fuzzy.FuzzyDateTime(timezone.now() - timedelta(days=365), timezone.now() - timedelta(days=180))
+    created_by = factory.SubFactory(UserFactory)
+
+
+class StatusLogFactory(DjangoModelFactory):
+    class Meta:
+        model = StatusLog
+
+    book = factory.SubFactory(BookFactory)
+    position = factory.LazyAttribute(lambda o: fuzzy.FuzzyInteger(0, o.book.total).fuzz())
+    created_at = fuzzy.FuzzyDateTime(timezone.now() - timedelta(days=180), timezone.now())
+    created_by = factory.SelfAttribute('book.created_by')
+
+
+class NoteFactory(DjangoModelFactory):
+    class Meta:
+        model = Note
+
+    book = factory.SubFactory(BookFactory)
+    position = factory.LazyAttribute(lambda o: fuzzy.FuzzyInteger(0, o.book.total).fuzz())
+    content = factory.Faker('text', max_nb_chars=200, locale='ja_JP')
+    quote_text = factory.Faker('text', max_nb_chars=100, locale='ja_JP')
+    created_at = fuzzy.FuzzyDateTime(timezone.now() - timedelta(days=180), timezone.now())
+    created_by = factory.SelfAttribute('book.created_by')
+
+
+def create_reading_history(user, books_count, status_per_book=10, notes_per_book=10, authors_count=None):
+    """
+    ユーザーの読書記録をまとめて作成
+    (save()を経由せずbulk_createで登録し、読書状態・日毎の集計・検索インデックスは最後にまとめて更新する)
+    """
+
+    authors = Author.objects.bulk_create(AuthorFactory.build_batch(authors_count or max(books_count // 5, 1)), batch_size=500)
+    books = Book.objects.bulk_create(BookFactory.build_batch(books_count, created_by=user), batch_size=500)
+
+    relations, status_log, notes = [], [], []
+    for i, book in enumerate(books):
+        relations.append(BookAuthorRelation(book=book, author=authors[i % len(authors)], order=0))
+        status_log += StatusLogFactory.build_batch(status_per_book, book=book, created_by=user)
+        notes += NoteFactory.build_batch(notes_per_book, book=book, created_by=user)
+
+    BookAuthorRelation.objects.bulk_create(relations, batch_size=500)
+    StatusLog.objects.bulk_create(status_log, batch_size=500)
+    Note.objects.bulk_create(notes, batch_size=500)
+
+    Book.objects.filter(created_by=user).refresh_reading_state()
+    DailyReadingStats.objects.rebuild(user)
+    SearchDocument.objects.index_books(books)
+    SearchDocument.objects.index_notes(notes)
+
+    return books
@@ -0,0 +1,150 @@
+"""
+アップロードされた画像のサムネイル (派生画像) の生成
+
+画像の保存後にバックグラウンドでPillowを使って縮小し、設定されたストレージ (ローカル・Cloudinary) に保存する。
+生成したサムネイルのURLはモデルの `<フィールド名>_thumbnail` に記録し、シリアライズ時はそれを読むだけにする。
+サムネイルが空のままの画像 (生成前・生成に失敗したもの) は、管理コマンド generate_thumbnails で生成し直せる。
+"""
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from hashlib import md5
+from PIL import Image, ImageOps
+import io
+
+from .cache import bump_user_cache_version
+from .tasks import run_in_background
+
+# サムネイルのサイズ (幅, 高さ)。高さがNoneの場合は幅に合わせて縦横比を保ったまま縮小する
+THUMBNAIL_SIZES = {
+    'avatar': (128, 128),
+    'quote_image': (350, None),
+}
+
+THUMBNAIL_DIR = 'thumbnails'
+
+
+def get_absolute_url(url):
+    """ストレージのURLを絶対URLにする (ローカルのストレージの場合はHOST_URLを付ける)"""
+
+    if url.startswith('/'):
+        url = '{}{}'.format(settings.HOST_URL, url)
+    return url
+
+
+def get_image_url(file):
+    """画像の絶対URLを取得 (画像がない場合はNone)"""
+
+    return get_absolute_url(file.url) if file else None
+
+
+def get_thumbnail_name(model_label, pk, field_name, name, size):
+    """
+    サムネイルのファイル名 (モデル・主キー・フィールドと元の画像のパスごとに異なる名前にする)
+    元の画像のファイル名だけを使うと、別の行の同じ名前の画像 (photo.jpg・photo.pngなど) とサムネイルが重なるため
+    """
+
+    width, height = size
+    digest = md5('{}:{}:{}:{}'.format(model_label, pk, field_name, name).encode()).hexdigest()
+    return '{}/{}_{}x{}.jpg'.format(THUMBNAIL_DIR, digest, width, height or 'auto')
+
+
+def resize_image(file, size):
+    """画像を縮小してJPEGのContentFileを返す (高さがNoneの場合は、元の画像より大きくはしない)"""
+
+    width, height = size
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+
+        # 透過部分は白で埋める
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        if height is None:
+            image.thumbnail((width, image.height), Image.LANCZOS)
+        else:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+
+    return ContentFile(buffer.getvalue())
+
+
+def generate_thumbnail(model_label, pk, field_name, name):
+    """
+    画像のサムネイルを生成し、URLをモデルに記録 (記録したURLを返す)
+    生成中に画像が差し替えられた場合は記録しない (差し替え後の画像のタスクで生成する)
+    """
+
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk, **{field_name: name}).first()
+    if instance is None:
+        return None
+
+    file = getattr(instance, field_name)
+    size = THUMBNAIL_SIZES[field_name]
+    with file.open('rb'):
+        content = resize_image(file, size)
+
+    # 既存のファイルは消さず、同じ名前がある場合はストレージに別の名前を付けさせる
+    storage = file.storage
+    thumbnail_name = storage.save(get_thumbnail_name(model_label, pk, field_name, name, size), content)
+
+    url = get_absolute_url(storage.url(thumbnail_name))
+    updated = model.objects.filter(pk=pk, **{field_name: name}).update(**{f'{field_name}_thumbnail': url})
+    if not updated:
+        # 保存したばかりのファイルのため、他の行からは参照されていない
+        storage.delete(thumbnail_name)
+        return None
+
+    # サムネイルのURLはキャッシュされたレスポンスにも含まれるため、ユーザーのキャッシュを無効化する
+    user = instance if model is apps.get_model(settings.AUTH_USER_MODEL) else instance.created_by
+    if user is not None:
+        bump_user_cache_version(user)
+
+    return url
+
+
+def prepare_thumbnail(instance, field_name, save_kwargs):
+    """
+    モデルのsave()の前に呼び出し、画像が差し替えられる場合はサムネイルを空にする (生成が必要な場合はTrueを返す)
+    save()にupdate_fieldsが指定された場合は、画像を更新する場合のみ対象とし、サムネイルも更新するフィールドに加える
+    """
+
+    thumbnail_field = f'{field_name}_thumbnail'
+    update_fields = save_kwargs.get('update_fields')
+    if update_fields is not None:
+        if field_name not in update_fields:
+            return False
+        save_kwargs['update_fields'] = {*update_fields, thumbnail_field}
+
+    file = getattr(instance, field_name)
+
+    if not file:
+        setattr(instance, thumbnail_field, None)
+        return False
+
+    # 新しくアップロードされたファイルは、保存されるまで_committedがFalseになる
+    if getattr(file, '_committed', True):
+        return False
+
+    setattr(instance, thumbnail_field, None)
+    return True
+
+
+def schedule_thumbnail(instance, field_name):
+    """モデルの保存後に呼び出し、トランザクションのコミット後にサムネイルを生成する"""
+
+    name = getattr(instance, field_name).name
+    model_label = instance._meta.label
+    run_in_background(
+        generate_thumbnail, model_label, instance.pk, field_name, name,
+        name=f'thumbnail:{model_label}:{instance.pk}:{field_name}:{name}',
+    )
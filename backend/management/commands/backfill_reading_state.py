@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+
+from backend.models import Book
+
+
+class Command(BaseCommand):
+    """書籍の現在の位置・読書状態・最終アクセス日をステータスの履歴から再計算する"""
+
+    help = '書籍の現在の位置・読書状態・最終アクセス日をステータスの履歴から再計算します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='対象のユーザー名 (省略時は全ユーザー)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+
+        # ユーザー単位でまとめて更新する
+        total = 0
+        for user in users.iterator():
+            total += Book.objects.filter(created_by=user).refresh_reading_state()
+
+        if not options['username']:
+            total += Book.objects.filter(created_by=None).refresh_reading_state()
+
+        self.stdout.write(self.style.SUCCESS(f'{total}件の書籍を更新しました。'))
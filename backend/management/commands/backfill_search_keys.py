@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Author, Book
+from backend.search import normalize_search_text
+
+
+class Command(BaseCommand):
+    """著者名・書名の検索キー (正規化した文字列) を作り直す"""
+
+    help = '著者名・書名の検索キー (正規化した文字列) を作り直します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回に更新する件数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        total = 0
+        for model, field, source in ((Author, 'search_key', 'name'), (Book, 'title_search_key', 'title')):
+            max_length = model._meta.get_field(field).max_length
+            objs = []
+            for obj in model.objects.only('pk', source, field).iterator(chunk_size=batch_size):
+                key = normalize_search_text(getattr(obj, source))[:max_length]
+                if getattr(obj, field) != key:
+                    setattr(obj, field, key)
+                    objs.append(obj)
+
+                if len(objs) >= batch_size:
+                    model.objects.bulk_update(objs, [field])
+                    total, objs = total + len(objs), []
+
+            if objs:
+                model.objects.bulk_update(objs, [field])
+                total += len(objs)
+
+        self.stdout.write(self.style.SUCCESS(f'{total}件の検索キーを更新しました。'))
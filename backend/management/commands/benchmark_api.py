@@ -0,0 +1,171 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from statistics import median
+import json
+import platform
+import time
+
+from backend.cache import bump_user_cache_version
+from backend.factories import UserFactory, create_reading_history
+from backend.models import Book, Note, StatusLog
+
+
+def get_endpoints(user):
+    """計測するエンドポイント (名前, メソッド, パス, データ)"""
+
+    book = Book.objects.filter(created_by=user).order_by('created_at').first()
+    status_log = StatusLog.objects.filter(created_by=user).order_by('created_at').first()
+    note = Note.objects.filter(created_by=user).order_by('created_at').first()
+    now = timezone.now().isoformat()
+
+    return [
+        ('book list', 'get', '/api/v1/book/', None),
+        ('book list (expand)', 'get', '/api/v1/book/?expand=status,note', None),
+        ('book search', 'get', '/api/v1/book/?q=の', None),
+        ('book detail', 'get', f'/api/v1/book/{book.id}/', None),
+        ('book create', 'post', '/api/v1/book/', {
+            'id_google': 'benchmark001', 'title': 'ベンチマーク', 'authors': ['著者'], 'total': 300,
+        }),
+        ('book update', 'patch', f'/api/v1/book/{book.id}/', {'authors': ['著者 変更']}),
+        ('book delete', 'delete', f'/api/v1/book/{book.id}/', None),
+        ('book import', 'post', '/api/v1/book/import/', [
+            {'id_google': f'import{i:06d}', 'title': f'インポート {i}', 'authors': [f'著者 {i}'], 'total': 300,
+             'status': [{'position': 100, 'created_at': now}]}
+            for i in range(20)
+        ]),
+        ('status list', 'get', '/api/v1/status/', None),
+        ('status list (cursor)', 'get', '/api/v1/status/?pagination=cursor', None),
+        ('status stream', 'get', '/api/v1/status/?stream=1', None),
+        ('status detail', 'get', f'/api/v1/status/{status_log.id}/', None),
+        ('status create', 'post', '/api/v1/status/', {'book': str(book.id), 'position': 1}),
+        ('status batch', 'post', '/api/v1/status/batch/', [
+            {'book': str(book.id), 'position': i} for i in range(20)
+        ]),
+        ('note list', 'get', '/api/v1/note/', None),
+        ('note detail', 'get', f'/api/v1/note/{note.id}/', None),
+        ('note create', 'post', '/api/v1/note/', {'book': str(book.id), 'position': 1, 'content': 'メモ'}),
+        ('dashboard', 'get', '/api/v1/dashboard/', None),
+        ('analytics', 'get', '/api/v1/analytics/', None),
+        ('analytics (filtered)', 'get', f'/api/v1/analytics/?book={book.id}', None),
+        ('author', 'get', '/api/v1/author/', None),
+        ('pages', 'get', '/api/v1/pages/', None),
+        ('pages (month)', 'get', '/api/v1/pages/?granularity=month', None),
+        ('export', 'get', '/api/v1/export/', None),
+        ('inquiry', 'post', '/api/v1/inquiry/', {'email': 'user@example.com', 'title': '件名', 'content': '本文'}),
+        ('users/me', 'get', '/api/v1/auth/users/me/', None),
+        ('users/me (analytics)', 'get', '/api/v1/auth/users/me/?include=analytics', None),
+    ]
+
+
+class Command(BaseCommand):
+    """APIの各エンドポイントのクエリ数・処理時間・レスポンスサイズを、データ量ごとに計測する"""
+
+    help = 'APIの各エンドポイントのクエリ数・処理時間・レスポンスサイズを、データ量ごとに計測します。(テスト用のDBを使用)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='100,1000,10000', help='書籍の冊数 (カンマ区切り、ステータス・メモは10倍)')
+        parser.add_argument('--repeat', type=int, default=3, help='1エンドポイントあたりの計測回数 (処理時間は中央値)')
+        parser.add_argument('--output', default='benchmark.json', help='結果を書き出すJSONファイル')
+        parser.add_argument('--baseline', help='比較するベースラインのJSONファイル')
+        parser.add_argument('--threshold', type=float, default=0.2, help='ベースラインに対して許容する増加率')
+        parser.add_argument('--keepdb', action='store_true', help='テスト用のDBを削除せずに残す')
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options['scales'].split(',')]
+
+        runner = DiscoverRunner(keepdb=options['keepdb'], verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            # 書き込みのエンドポイントはロールバックするため、コミット後のバックグラウンドタスクは実行しない
+            # 書籍の登録でGoogle Books APIに問い合わせないよう、書籍情報の取得は何もしないupstreamにする
+            book_metadata = {**getattr(settings, 'BOOK_METADATA', {}), 'UPSTREAM': 'backend.metadata.NullUpstream'}
+            with override_settings(BACKGROUND_TASKS_ENABLED=False, ALLOWED_HOSTS=['*'], BOOK_METADATA=book_metadata):
+                results = {str(scale): self.run_scale(scale, options['repeat']) for scale in scales}
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'repeat': options['repeat'],
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'結果を{options["output"]}に書き出しました。'))
+
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['threshold'])
+
+    def run_scale(self, scale, repeat):
+        self.stdout.write(f'書籍{scale}冊のデータを作成しています...')
+        user = UserFactory(username=f'benchmark{scale}')
+        create_reading_history(user, scale)
+
+        client = APIClient()
+        client.force_authenticate(user)
+
+        results = {}
+        for name, method, path, data in get_endpoints(user):
+            times, queries = [], 0
+            for _ in range(repeat):
+                # キャッシュされたレスポンスを計測しないよう、毎回キャッシュを無効化する
+                bump_user_cache_version(user)
+
+                # 書き込みは毎回ロールバックし、データ量を変えない
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as context:
+                        start = time.perf_counter()
+                        res = getattr(client, method)(path, data, format='json')
+                        content = b''.join(res.streaming_content) if res.streaming else res.content
+                        elapsed = time.perf_counter() - start
+                    transaction.set_rollback(True)
+
+                times.append(elapsed * 1000)
+                queries = max(queries, len(context))
+
+            results[name] = {
+                'status': res.status_code,
+                'queries': queries,
+                'time_ms': round(median(times), 2),
+                'bytes': len(content),
+            }
+            self.stdout.write('  {:<24} {:>4} queries {:>9.2f} ms {:>9} bytes'.format(
+                name, queries, results[name]['time_ms'], len(content)
+            ))
+
+        return results
+
+    def compare(self, report, baseline_path, threshold):
+        """ベースラインと比較し、クエリ数・処理時間がthreshold以上増えていれば失敗とする"""
+
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for scale, endpoints in report['results'].items():
+            for name, result in endpoints.items():
+                base = baseline.get('results', {}).get(scale, {}).get(name)
+                if base is None:
+                    continue
+
+                for key in ('queries', 'time_ms'):
+                    if result[key] > base[key] * (1 + threshold):
+                        regressions.append(f'{scale}冊 {name}: {key} {base[key]} → {result[key]}')
+
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f'{len(regressions)}件の計測値がベースラインから悪化しています。')
+
+        self.stdout.write(self.style.SUCCESS('ベースラインからの悪化はありません。'))
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+import re
+import uuid
+
+from backend.models import Author, AuthorSummary, Book, BookAuthorRelation, DailyReadingStats, Note, StatusLog
+from backend.search import get_search_key_lookup
+
+
+def get_queries():
+    """主要なエンドポイントのメインのクエリ (名前, テーブル名, queryset)"""
+
+    user_id, book_id, now = uuid.uuid4(), uuid.uuid4(), timezone.now()
+
+    queries = [
+        ('書籍の登録 (重複の確認)', 'book', Book.objects.filter(created_by_id=user_id, id_google='xxxxxxxxxxxx')),
+        ('書籍の一覧', 'book', Book.objects.filter(created_by_id=user_id).sort_by_accessed_at()[:12]),
+        ('ステータスの一覧', 'status_log', StatusLog.objects.filter(created_by_id=user_id).order_by('-created_at', '-pk')[:12]),
+        ('直前のステータス', 'status_log',
+         StatusLog.objects.filter(book_id=book_id, created_at__lt=now, position__gt=0).order_by('-created_at')[:1]),
+        ('メモの一覧', 'note', Note.objects.filter(created_by_id=user_id).order_by('-created_at', '-pk')[:12]),
+        ('書籍の著者', 'book_author', BookAuthorRelation.objects.filter(book_id=book_id).order_by('order')),
+        ('著者名の検索', 'author', Author.objects.filter(name='著者')),
+        ('著者の集計', 'author_summary', AuthorSummary.objects.filter(user_id=user_id).sort_by_books_count()[:50]),
+        ('日毎の集計', 'daily_reading_stats',
+         DailyReadingStats.objects.filter(user_id=user_id, date__gte=now.date() - timedelta(days=30))),
+    ]
+
+    if connection.vendor == 'postgresql':
+        # SQLiteのLIKEは大文字・小文字を区別しないため、検索キーの前方一致にインデックスを使えない
+        queries += [
+            ('著者名の検索 (1文字)', 'author', Author.objects.filter(**get_search_key_lookup('search_key', 'あ'))),
+            ('書籍名の検索 (1文字)', 'book', Book.objects.filter(created_by_id=user_id, **get_search_key_lookup('title_search_key', 'あ'))),
+        ]
+
+    return queries
+
+
+def uses_index(plan, table):
+    """実行計画で、テーブルをインデックス経由で読んでいるか"""
+
+    if connection.vendor == 'postgresql':
+        if re.search(rf'Seq Scan on {table}\b', plan):
+            return False
+        return bool(re.search(rf'Index (Only )?Scan (Backward )?using \S+ on {table}\b|Bitmap Heap Scan on {table}\b', plan))
+
+    # SQLite: "SEARCH table USING INDEX ..." / "SCAN table USING COVERING INDEX ..."
+    lines = [line for line in plan.splitlines() if re.search(rf'\b(SCAN|SEARCH) {table}\b', line)]
+    return bool(lines) and all('USING' in line for line in lines)
+
+
+class Command(BaseCommand):
+    """主要なエンドポイントのクエリが、インデックスを使っているかをEXPLAINで確認する"""
+
+    help = '主要なエンドポイントのクエリが、インデックスを使っているかをEXPLAINで確認します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plan', action='store_true', help='実行計画を表示する')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError('PostgreSQL・SQLiteのみ対応しています。')
+
+        failed = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # データ量が少ない環境でもインデックスの有無を判定できるよう、シーケンシャルスキャンを避けさせる
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for name, table, queryset in get_queries():
+                plan = queryset.explain()
+                ok = uses_index(plan, table)
+                if not ok:
+                    failed.append(name)
+
+                self.stdout.write('{} {}'.format(self.style.SUCCESS('OK') if ok else self.style.ERROR('NG'), name))
+                if options['verbose_plan'] or not ok:
+                    self.stdout.write(plan)
+
+        if failed:
+            raise CommandError('インデックスを使っていないクエリがあります: {}'.format(', '.join(failed)))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Author, AuthorSummary, Book, PendingAuthorCleanup, SearchDocument
+
+
+class Command(BaseCommand):
+    """表記ゆれのある著者をまとめ、孤立した著者を削除する"""
+
+    help = '表記ゆれのある著者をまとめ、孤立した著者を削除します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='削除待ちの著者だけでなく、すべての著者から孤立したものを探す')
+        parser.add_argument('--batch-size', type=int, default=500, help='1回に削除する著者の件数')
+
+    def handle(self, *args, **options):
+        # 表記ゆれのある著者をまとめ、著者名の変わった書籍を再インデックス・著者の集計を再計算する
+        book_ids = Author.objects.merge_duplicates()
+        SearchDocument.objects.index_books(list(Book.objects.filter(pk__in=book_ids)))
+        AuthorSummary.objects.refresh_books(book_ids)
+
+        if options['all']:
+            author_ids = Author.objects.filter(books=None).values_list('pk', flat=True)
+            PendingAuthorCleanup.objects.bulk_create(
+                [PendingAuthorCleanup(author_id=author_id) for author_id in author_ids], ignore_conflicts=True
+            )
+
+        deleted = Author.objects.delete_orphans(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'{len(book_ids)}冊の著者をまとめ、{deleted}件の著者を削除しました。'))
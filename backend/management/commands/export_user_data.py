@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+
+from apiv1.export import EXPORT_RESOURCES, EXPORT_FORMATS, export_ndjson, export_csv
+
+
+class Command(BaseCommand):
+    """ユーザーの読書記録をNDJSON・CSVで書き出す (バックアップ用)"""
+
+    help = 'ユーザーの読書記録をNDJSON・CSVで書き出します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help='対象のユーザー名')
+        parser.add_argument('--output', choices=EXPORT_FORMATS, default='ndjson', help='出力形式')
+        parser.add_argument('--resource', action='append', choices=EXPORT_RESOURCES,
+                            help='出力するリソース (省略時は全て、CSVの場合は1つのみ)')
+        parser.add_argument('--file', help='出力先のファイル (省略時は標準出力)')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('ユーザーが存在しません。')
+
+        resources = options['resource'] or list(EXPORT_RESOURCES)
+        if options['output'] == 'csv':
+            if len(resources) != 1:
+                raise CommandError('CSVの場合はリソースを1つだけ指定してください。')
+            content = export_csv(resources[0], user)
+        else:
+            content = export_ndjson(resources, user)
+
+        if options['file']:
+            with open(options['file'], 'wb') as f:
+                for line in content:
+                    f.write(line)
+        else:
+            for line in content:
+                self.stdout.write(line.decode('utf-8'), ending='')
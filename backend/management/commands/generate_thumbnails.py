@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from backend.images import generate_thumbnail
+from backend.models import CustomUser, Note
+
+
+class Command(BaseCommand):
+    """ユーザーの写真・メモの引用画像のサムネイルを生成する"""
+
+    help = 'サムネイルが未生成の画像 (ユーザーの写真・メモの引用画像) のサムネイルを生成します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='生成済みのサムネイルも作り直す')
+
+    def handle(self, *args, **options):
+        total = failed = 0
+        for model, field_name in ((CustomUser, 'avatar'), (Note, 'quote_image')):
+            queryset = model.objects.exclude(Q(**{f'{field_name}__isnull': True}) | Q(**{field_name: ''}))
+            if not options['all']:
+                queryset = queryset.filter(**{f'{field_name}_thumbnail__isnull': True})
+
+            for pk, name in queryset.order_by().values_list('pk', field_name).iterator():
+                try:
+                    generate_thumbnail(model._meta.label, pk, field_name, name)
+                    total += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} {pk} ({name}): {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'{total}件のサムネイルを生成しました。(失敗: {failed}件)'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+import json
+
+from apiv1.importer import import_books
+
+
+class Command(BaseCommand):
+    """書籍をステータスの履歴ごと一括登録する (JSONの配列 or NDJSON)"""
+
+    help = '書籍をステータスの履歴ごと一括登録します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='書籍のリストのファイル (JSONの配列 or 1行に1冊のNDJSON)')
+        parser.add_argument('--username', required=True, help='登録先のユーザー名')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('ユーザーが存在しません。')
+
+        with open(options['file'], encoding='utf-8') as f:
+            content = f.read()
+
+        try:
+            if content.lstrip().startswith('['):
+                rows = json.loads(content)
+            else:
+                rows = [json.loads(line) for line in content.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise CommandError(f'ファイルを読み込めません: {e}')
+
+        result = import_books(user, rows)
+
+        for error in result['errors']:
+            self.stderr.write('{}行目: {}'.format(error['index'] + 1, json.dumps(error['errors'], ensure_ascii=False)))
+
+        self.stdout.write(self.style.SUCCESS('{}件を登録しました。(スキップ: {}件, エラー: {}件)'.format(
+            len(result['created']), len(result['skipped']), len(result['errors'])
+        )))
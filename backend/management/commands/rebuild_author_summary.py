@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+
+from backend.models import AuthorSummary
+
+
+class Command(BaseCommand):
+    """ユーザーごとの著者の集計を書籍と著者の紐付けから再計算する"""
+
+    help = 'ユーザーごとの著者の集計を書籍と著者の紐付けから再計算します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='対象のユーザー名 (省略時は全ユーザー)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+
+        total = 0
+        for user in users.iterator():
+            total += len(AuthorSummary.objects.rebuild(user))
+
+        self.stdout.write(self.style.SUCCESS(f'{total}件の著者の集計を作成しました。'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+
+from backend.models import DailyReadingStats
+
+
+class Command(BaseCommand):
+    """ユーザーごとの日毎の読書記録の集計をステータスの履歴から再計算する"""
+
+    help = 'ユーザーごとの日毎の読書記録の集計をステータスの履歴から再計算します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='対象のユーザー名 (省略時は全ユーザー)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+
+        total = 0
+        for user in users.iterator():
+            total += len(DailyReadingStats.objects.rebuild(user))
+
+        self.stdout.write(self.style.SUCCESS(f'{total}日分の集計を作成しました。'))
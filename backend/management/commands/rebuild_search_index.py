@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Book, Note, SearchDocument
+
+
+class Command(BaseCommand):
+    """書籍・メモの全文検索用インデックスを作り直す"""
+
+    help = '書籍のタイトル・著者名、メモの本文・引用の全文検索用インデックスを作り直します。'
+
+    def handle(self, *args, **options):
+        for book in Book.objects.select_related('created_by').iterator(chunk_size=500):
+            SearchDocument.objects.index_book(book)
+
+        for note in Note.objects.select_related('created_by').iterator(chunk_size=500):
+            SearchDocument.objects.index_note(note)
+
+        self.stdout.write(self.style.SUCCESS(f'{SearchDocument.objects.count()}件の文書を登録しました。'))
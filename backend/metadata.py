@@ -0,0 +1,204 @@
+"""
+Google Books APIの書籍情報の取得・キャッシュ
+
+書籍の情報はGoogle Books IDごとにBookMetadataのテーブルへ保存し、全ユーザーで共有する。
+保存から一定期間 (TTL) が過ぎたものは取得し直し、件数が上限を超えた場合は最終アクセス日時の古いものから削除する (LRU)。
+キャッシュにない書籍はまとめて並列に取得し、同じ書籍を同時に取得しようとしたスレッドは、先に始めた取得の結果を待つ。
+取得に失敗した場合は、期限の切れたキャッシュがあればそれを使う。
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from datetime import timedelta
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from threading import Lock
+from urllib.parse import quote
+import logging
+import re
+import requests
+
+from .models import BookMetadata
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Google Books IDの形式 (キャッシュの主キー・APIのパスに使うため、これ以外のIDは問い合わせない)
+ID_GOOGLE_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,12}$')
+
+
+def get_metadata_setting(name):
+    defaults = {
+        'UPSTREAM': 'backend.metadata.GoogleBooksUpstream',
+        'OPTIONS': {},
+        'TTL': 60 * 60 * 24 * 30,
+        'NOT_FOUND_TTL': 60 * 60 * 24,
+        'MAX_ENTRIES': 100000,
+        'WAIT_TIMEOUT': 10,
+    }
+    return getattr(settings, 'BOOK_METADATA', {}).get(name, defaults[name])
+
+
+def is_valid_id_google(value):
+    return isinstance(value, str) and ID_GOOGLE_PATTERN.match(value) is not None
+
+
+def parse_volume(volume):
+    """Google Books APIのVolumeから、キャッシュに保存する情報を取り出す"""
+
+    info = volume.get('volumeInfo', {})
+    identifiers = {item.get('type'): item.get('identifier') for item in info.get('industryIdentifiers', [])}
+    thumbnail = info.get('imageLinks', {}).get('thumbnail')
+
+    return {
+        'title': (info.get('title') or '')[:255],
+        'authors': info.get('authors') or [],
+        # 混在コンテンツにならないよう、表紙の画像はHTTPSで参照する
+        'thumbnail': thumbnail.replace('http://', 'https://', 1) if thumbnail else None,
+        'page_count': info.get('pageCount') or None,
+        # ISBN_13→ISBN_10の順に使う (フロントエンドの書籍の追加と同じ)
+        'amazon_dp': identifiers.get('ISBN_13') or identifiers.get('ISBN_10'),
+    }
+
+
+class GoogleBooksUpstream():
+    """Google Books APIから書籍の情報を取得する (api_urlを変えることで、テスト用のサーバーにも向けられる)"""
+
+    def __init__(self, api_url='https://www.googleapis.com/books/v1/volumes', api_key=None, timeout=5, max_workers=4):
+        self.api_url = api_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.session = requests.Session()
+
+    def fetch_one(self, id_google):
+        """1冊分の情報を取得 (見つからない場合はNone、取得に失敗した場合は例外)"""
+
+        params = {'key': self.api_key} if self.api_key else {}
+        url = '{}/{}'.format(self.api_url, quote(id_google, safe=''))
+        res = self.session.get(url, params=params, timeout=self.timeout)
+        if res.status_code == 404:
+            return None
+
+        res.raise_for_status()
+        return parse_volume(res.json())
+
+    def fetch(self, ids):
+        """複数の書籍の情報を並列に取得し、ID: 情報の辞書を返す (取得に失敗したIDは含めない)"""
+
+        ret = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ids)) or 1) as executor:
+            for id_google, future in [(id_google, executor.submit(self.fetch_one, id_google)) for id_google in ids]:
+                try:
+                    ret[id_google] = future.result()
+                except (requests.RequestException, ValueError):
+                    logger.warning('Google Books APIから書籍の情報を取得できませんでした: %s', id_google, exc_info=True)
+
+        return ret
+
+
+class NullUpstream():
+    """何も取得しないupstream (外部のAPIに問い合わせないベンチマークなどで使う)"""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def fetch(self, ids):
+        return {}
+
+
+class BookMetadataService():
+    """Google Books IDから書籍の情報を取得する (キャッシュにない・古いものはupstreamから取得)"""
+
+    def __init__(self, upstream=None):
+        self._upstream = upstream
+        self._lock = Lock()
+        self._pending = {}
+
+    @property
+    def upstream(self):
+        if self._upstream is None:
+            self._upstream = import_string(get_metadata_setting('UPSTREAM'))(**get_metadata_setting('OPTIONS'))
+        return self._upstream
+
+    def is_fresh(self, metadata, now):
+        ttl = get_metadata_setting('TTL' if metadata.found else 'NOT_FOUND_TTL')
+        return metadata.fetched_at >= now - timedelta(seconds=ttl)
+
+    def get(self, id_google):
+        """1冊分の情報を取得 (見つからない場合はNone)"""
+
+        return self.get_many([id_google]).get(id_google)
+
+    def get_many(self, ids):
+        """複数の書籍の情報をまとめて取得し、ID: BookMetadataの辞書を返す (見つからなかったIDは含めない)"""
+
+        ids = list(dict.fromkeys(id_google for id_google in ids if is_valid_id_google(id_google)))
+        if not ids:
+            return {}
+
+        now = timezone.now()
+        cached, stale = {}, {}
+        for id_google, metadata in BookMetadata.objects.in_bulk(ids).items():
+            if self.is_fresh(metadata, now):
+                cached[id_google] = metadata
+            else:
+                stale[id_google] = metadata
+        BookMetadata.objects.touch(list(cached), now)
+
+        missing = [id_google for id_google in ids if id_google not in cached]
+        if missing:
+            fetched = self._fetch(missing, now)
+            cached.update({id_google: fetched.get(id_google, stale.get(id_google)) for id_google in missing})
+            cached = {id_google: metadata for id_google, metadata in cached.items() if metadata is not None}
+
+        return {id_google: metadata for id_google, metadata in cached.items() if metadata.found}
+
+    def _fetch(self, ids, now):
+        """upstreamから取得して保存 (他のスレッドが取得中の書籍は、その結果を待つ)"""
+
+        with self._lock:
+            waiting = {id_google: self._pending[id_google] for id_google in ids if id_google in self._pending}
+            fetching = [id_google for id_google in ids if id_google not in waiting]
+            for id_google in fetching:
+                self._pending[id_google] = Future()
+
+        ret = {}
+        try:
+            if fetching:
+                try:
+                    fetched = self.upstream.fetch(fetching)
+                except Exception:
+                    logger.exception('書籍の情報を取得できませんでした')
+                    fetched = {}
+
+                ret = BookMetadata.objects.store(fetched, now)
+                if ret:
+                    run_in_background(BookMetadata.objects.evict, get_metadata_setting('MAX_ENTRIES'), name='evict_book_metadata')
+        finally:
+            with self._lock:
+                for id_google in fetching:
+                    self._pending.pop(id_google).set_result(ret.get(id_google))
+
+        for id_google, future in waiting.items():
+            try:
+                metadata = future.result(timeout=get_metadata_setting('WAIT_TIMEOUT'))
+            except TimeoutError:
+                metadata = None
+            if metadata is not None:
+                ret[id_google] = metadata
+
+        return ret
+
+
+book_metadata = BookMetadataService()
+
+
+@receiver(setting_changed)
+def reset_upstream(setting, **kwargs):
+    """設定が変更された場合 (テストのoverride_settingsなど) は、upstreamを作り直す"""
+
+    if setting == 'BOOK_METADATA':
+        book_metadata._upstream = None
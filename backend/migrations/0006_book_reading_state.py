@@ -0,0 +1,56 @@
+# Generated by Django 3.2.8 on 2026-10-18 10:41
+
+from django.db import migrations, models
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_reading_state(apps, schema_editor):
+    Book = apps.get_model('backend', 'Book')
+    StatusLog = apps.get_model('backend', 'StatusLog')
+
+    latest_status = StatusLog.objects.filter(book=OuterRef('pk')).order_by('-created_at')
+    Book.objects.update(
+        current_position=Coalesce(Subquery(latest_status.values('position')[:1]), 0),
+        last_accessed_at=Coalesce(Subquery(latest_status.values('created_at')[:1]), F('created_at')),
+    )
+    Book.objects.update(state=Case(
+        When(current_position__lte=0, then=Value('to_be_read')),
+        When(current_position__lt=F('total'), then=Value('reading')),
+        default=Value('read'),
+        output_field=models.CharField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_auto_20220225_1731'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='current_position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='last_accessed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='state',
+            field=models.CharField(choices=[('to_be_read', 'To be read'), ('reading', 'Reading'), ('read', 'Read')], default='to_be_read', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['created_by', 'state'], name='book_created_by_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['created_by', '-last_accessed_at'], name='book_created_by_accessed_idx'),
+        ),
+        migrations.RunPython(backfill_reading_state, migrations.RunPython.noop),
+    ]
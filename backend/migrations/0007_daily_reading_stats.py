@@ -0,0 +1,76 @@
+# Generated by Django 3.2.8 on 2026-10-18 10:46
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Ceil, Coalesce, TruncDate
+import django.db.models.deletion
+
+
+def build_daily_reading_stats(apps, schema_editor):
+    StatusLog = apps.get_model('backend', 'StatusLog')
+    DailyReadingStats = apps.get_model('backend', 'DailyReadingStats')
+
+    prev_status = StatusLog.objects.filter(
+        book=OuterRef('book'), created_at__lt=OuterRef('created_at'), position__gt=0
+    ).order_by('-created_at')
+    rows = StatusLog.objects.exclude(created_by=None).annotate(
+        prev_position=Coalesce(Subquery(prev_status.values('position')[:1]), 0),
+    ).annotate(diff_value=Case(
+        When(position__gt=F('prev_position'), then=F('position') - F('prev_position')),
+        default=Value(0),
+    )).annotate(diff_page=Case(
+        When(book__format_type=1, then=Cast(
+            Ceil(Cast(F('book__total_page') * F('diff_value'), models.FloatField()) / F('book__total')),
+            models.IntegerField(),
+        )),
+        default=F('diff_value'),
+        output_field=models.IntegerField(),
+    )).annotate(date=TruncDate('created_at')).order_by().values('created_by', 'date').annotate(
+        pages=Sum('diff_page'),
+        status_count=Count('id', filter=Q(position__gt=0)),
+        books_to_be_read=Count('book', distinct=True, filter=Q(position=0)),
+        books_reading=Count('book', distinct=True, filter=Q(position__gt=0, position__lt=F('book__total'))),
+        books_read=Count('book', distinct=True, filter=Q(position__gte=F('book__total'))),
+        first_activity_at=Min('created_at'),
+        last_activity_at=Max('created_at'),
+    )
+
+    DailyReadingStats.objects.bulk_create(
+        [DailyReadingStats(user_id=row.pop('created_by'), **row) for row in rows.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_book_reading_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyReadingStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('pages', models.IntegerField(default=0)),
+                ('status_count', models.IntegerField(default=0)),
+                ('books_to_be_read', models.IntegerField(default=0)),
+                ('books_reading', models.IntegerField(default=0)),
+                ('books_read', models.IntegerField(default=0)),
+                ('first_activity_at', models.DateTimeField()),
+                ('last_activity_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_reading_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'daily_reading_stats',
+                'ordering': ['user', 'date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyreadingstats',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='daily_reading_stats_user_date_unique'),
+        ),
+        migrations.RunPython(build_daily_reading_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 3.2.8 on 2026-10-18 10:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from backend.search import normalize_search_text, tokenize
+
+
+SQLITE_FTS_SQL = [
+    "CREATE VIRTUAL TABLE search_document_fts USING fts5(tokens, content='search_document', content_rowid='id')",
+    """CREATE TRIGGER search_document_ai AFTER INSERT ON search_document BEGIN
+        INSERT INTO search_document_fts(rowid, tokens) VALUES (new.id, new.tokens);
+    END""",
+    """CREATE TRIGGER search_document_ad AFTER DELETE ON search_document BEGIN
+        INSERT INTO search_document_fts(search_document_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+    END""",
+    """CREATE TRIGGER search_document_au AFTER UPDATE ON search_document BEGIN
+        INSERT INTO search_document_fts(search_document_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+        INSERT INTO search_document_fts(rowid, tokens) VALUES (new.id, new.tokens);
+    END""",
+]
+
+SQLITE_FTS_REVERSE_SQL = [
+    'DROP TRIGGER IF EXISTS search_document_ai',
+    'DROP TRIGGER IF EXISTS search_document_ad',
+    'DROP TRIGGER IF EXISTS search_document_au',
+    'DROP TABLE IF EXISTS search_document_fts',
+]
+
+POSTGRESQL_INDEX_SQL = [
+    "CREATE INDEX search_document_tokens_idx ON search_document USING gin (string_to_array(tokens, ' '))",
+]
+
+POSTGRESQL_INDEX_REVERSE_SQL = [
+    'DROP INDEX IF EXISTS search_document_tokens_idx',
+]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        # FTS5が使えないSQLiteでは、検索時に通常の部分一致検索にフォールバックする
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                return
+        for sql in SQLITE_FTS_SQL:
+            schema_editor.execute(sql)
+    elif connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_INDEX_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for sql in SQLITE_FTS_REVERSE_SQL:
+            schema_editor.execute(sql)
+    elif connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_INDEX_REVERSE_SQL:
+            schema_editor.execute(sql)
+
+
+def build_search_documents(apps, schema_editor):
+    Book = apps.get_model('backend', 'Book')
+    Note = apps.get_model('backend', 'Note')
+    BookAuthorRelation = apps.get_model('backend', 'BookAuthorRelation')
+    SearchDocument = apps.get_model('backend', 'SearchDocument')
+
+    def make_document(value, **kwargs):
+        return SearchDocument(text=normalize_search_text(value), tokens=' '.join(tokenize(value)), **kwargs)
+
+    documents = []
+    for book in Book.objects.iterator():
+        documents.append(make_document(book.title, book=book, field='title', created_by_id=book.created_by_id))
+    for relation in BookAuthorRelation.objects.select_related('book', 'author').iterator():
+        documents.append(make_document(
+            relation.author.name, book=relation.book, field='authors', created_by_id=relation.book.created_by_id
+        ))
+    for note in Note.objects.iterator():
+        documents.append(make_document(note.content, note=note, field='content', created_by_id=note.created_by_id))
+        if note.quote_text:
+            documents.append(make_document(note.quote_text, note=note, field='quote_text', created_by_id=note.created_by_id))
+
+    SearchDocument.objects.bulk_create([document for document in documents if document.text], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_daily_reading_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('title', 'Title'), ('authors', 'Authors'), ('content', 'Content'), ('quote_text', 'Quote')], max_length=10)),
+                ('text', models.TextField()),
+                ('tokens', models.TextField()),
+                ('book', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='backend.book')),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to=settings.AUTH_USER_MODEL)),
+                ('note', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='backend.note')),
+            ],
+            options={
+                'db_table': 'search_document',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchdocument',
+            index=models.Index(fields=['book', 'field'], name='search_document_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchdocument',
+            index=models.Index(fields=['note', 'field'], name='search_document_note_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_orphan_authors(apps, schema_editor):
+    """既存の孤立した著者を削除待ちにする"""
+
+    Author = apps.get_model('backend', 'Author')
+    PendingAuthorCleanup = apps.get_model('backend', 'PendingAuthorCleanup')
+
+    author_ids = Author.objects.filter(books=None).values_list('id', flat=True)
+    PendingAuthorCleanup.objects.bulk_create(
+        [PendingAuthorCleanup(author_id=author_id) for author_id in author_ids.iterator()], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingAuthorCleanup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author_id', models.UUIDField(unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'pending_author_cleanup',
+            },
+        ),
+        migrations.RunPython(mark_orphan_authors, migrations.RunPython.noop),
+    ]
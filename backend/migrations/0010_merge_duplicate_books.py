@@ -0,0 +1,106 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:06
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Ceil, Coalesce, Greatest, TruncDate
+
+
+def merge_duplicate_books(apps, schema_editor):
+    """同一ユーザー・同一のGoogle Books IDの書籍を、最も古い書籍にまとめる (ステータス・メモは移動する)"""
+
+    Book = apps.get_model('backend', 'Book')
+    StatusLog = apps.get_model('backend', 'StatusLog')
+    Note = apps.get_model('backend', 'Note')
+    BookAuthorRelation = apps.get_model('backend', 'BookAuthorRelation')
+    DailyReadingStats = apps.get_model('backend', 'DailyReadingStats')
+    PendingAuthorCleanup = apps.get_model('backend', 'PendingAuthorCleanup')
+
+    duplicates = Book.objects.order_by().values('created_by', 'id_google').annotate(count=Count('id')).filter(count__gt=1)
+    kept_ids, user_ids = [], set()
+    for row in duplicates:
+        books = list(Book.objects.filter(created_by=row['created_by'], id_google=row['id_google']).order_by('created_at', 'id'))
+        kept, others = books[0], books[1:]
+        StatusLog.objects.filter(book__in=others).update(book=kept)
+        Note.objects.filter(book__in=others).update(book=kept)
+
+        # 削除する書籍の著者は削除待ちにする
+        author_ids = BookAuthorRelation.objects.filter(book__in=others).values_list('author_id', flat=True)
+        PendingAuthorCleanup.objects.bulk_create(
+            [PendingAuthorCleanup(author_id=author_id) for author_id in author_ids], ignore_conflicts=True
+        )
+        Book.objects.filter(pk__in=[book.pk for book in others]).delete()
+        kept_ids.append(kept.pk)
+        user_ids.add(row['created_by'])
+
+    if not kept_ids:
+        return
+
+    # まとめた書籍の読書状態を再計算
+    latest_status = StatusLog.objects.filter(book=OuterRef('pk')).order_by('-created_at')
+    Book.objects.filter(pk__in=kept_ids).update(
+        current_position=Coalesce(Subquery(latest_status.values('position')[:1]), 0),
+        last_accessed_at=Coalesce(Subquery(latest_status.values('created_at')[:1]), F('created_at')),
+    )
+    Book.objects.filter(pk__in=kept_ids).update(state=Case(
+        When(current_position__lte=0, then=Value('to_be_read')),
+        When(current_position__lt=F('total'), then=Value('reading')),
+        default=Value('read'),
+        output_field=models.CharField(),
+    ))
+
+    # 履歴がまとまり直前の位置が変わるため、該当ユーザーの日毎の集計を作り直す
+    prev_status = StatusLog.objects.filter(
+        book=OuterRef('book'), created_at__lt=OuterRef('created_at'), position__gt=0
+    ).order_by('-created_at')
+    rows = StatusLog.objects.filter(created_by__in=user_ids).annotate(
+        diff_value=Greatest(F('position') - Coalesce(Subquery(prev_status.values('position')[:1]), 0), 0),
+    ).annotate(diff_page=Case(
+        When(book__format_type=1, then=Cast(
+            Ceil(Cast(F('book__total_page') * F('diff_value'), models.FloatField()) / F('book__total')),
+            models.IntegerField(),
+        )),
+        default=F('diff_value'),
+        output_field=models.IntegerField(),
+    )).annotate(date=TruncDate('created_at')).order_by().values('created_by', 'date').annotate(
+        pages=Sum('diff_page'),
+        status_count=Count('id', filter=Q(position__gt=0)),
+        books_to_be_read=Count('book', distinct=True, filter=Q(position=0)),
+        books_reading=Count('book', distinct=True, filter=Q(position__gt=0, position__lt=F('book__total'))),
+        books_read=Count('book', distinct=True, filter=Q(position__gte=F('book__total'))),
+        first_activity_at=Min('created_at'),
+        last_activity_at=Max('created_at'),
+    )
+
+    DailyReadingStats.objects.filter(user__in=user_ids).delete()
+    DailyReadingStats.objects.bulk_create(
+        [DailyReadingStats(user_id=row.pop('created_by'), **row) for row in rows.iterator()],
+        batch_size=1000,
+    )
+
+
+def renumber_author_relations(apps, schema_editor):
+    """著者の順番が重複している書籍について、順番を振り直す"""
+
+    BookAuthorRelation = apps.get_model('backend', 'BookAuthorRelation')
+
+    book_ids = BookAuthorRelation.objects.order_by().values('book', 'order').annotate(count=Count('id')) \
+        .filter(count__gt=1).values_list('book', flat=True).distinct()
+    for book_id in list(book_ids):
+        relations = list(BookAuthorRelation.objects.filter(book_id=book_id).order_by('order', 'id'))
+        for i, relation in enumerate(relations):
+            relation.order = i
+        BookAuthorRelation.objects.bulk_update(relations, ['order'])
+
+
+# 一意制約を追加する前に重複したデータをまとめる
+# (PostgreSQLではデータを更新したトランザクション内でALTER TABLEできないため、制約の追加とはマイグレーションを分ける)
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_pending_author_cleanup'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_books, migrations.RunPython.noop),
+        migrations.RunPython(renumber_author_relations, migrations.RunPython.noop),
+    ]
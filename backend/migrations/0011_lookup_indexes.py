@@ -0,0 +1,42 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_merge_duplicate_books'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='dailyreadingstats',
+            options={'ordering': ['user_id', 'date']},
+        ),
+        migrations.AlterField(
+            model_name='author',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['created_by', '-created_at', '-id'], name='note_created_by_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statuslog',
+            index=models.Index(fields=['created_by', '-created_at', '-id'], name='status_log_created_by_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statuslog',
+            index=models.Index(fields=['book', '-created_at'], name='status_log_book_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(fields=('created_by', 'id_google'), name='book_created_by_id_google_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookauthorrelation',
+            constraint=models.UniqueConstraint(fields=('book', 'order'), name='book_author_book_order_unique'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:14
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def build_author_summary(apps, schema_editor):
+    BookAuthorRelation = apps.get_model('backend', 'BookAuthorRelation')
+    AuthorSummary = apps.get_model('backend', 'AuthorSummary')
+
+    rows = BookAuthorRelation.objects.filter(order=0).exclude(book__created_by=None).order_by() \
+        .values('book__created_by', 'author').annotate(
+            books_count=Count('book'),
+            books_to_be_read=Count('book', filter=Q(book__state='to_be_read')),
+            books_reading=Count('book', filter=Q(book__state='reading')),
+            books_read=Count('book', filter=Q(book__state='read')),
+        )
+
+    AuthorSummary.objects.bulk_create(
+        [AuthorSummary(user_id=row.pop('book__created_by'), author_id=row.pop('author'), **row) for row in rows.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('books_count', models.IntegerField(default=0)),
+                ('books_to_be_read', models.IntegerField(default=0)),
+                ('books_reading', models.IntegerField(default=0)),
+                ('books_read', models.IntegerField(default=0)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='backend.author')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='author_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'author_summary',
+                'ordering': ['user_id', '-books_count'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='authorsummary',
+            index=models.Index(fields=['user', '-books_count'], name='author_summary_user_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='authorsummary',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='author_summary_user_author_unique'),
+        ),
+        migrations.RunPython(build_author_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:22
+
+import backend.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_author_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='search_key',
+            field=backend.search.SearchKeyField(blank=True, default='', editable=False, max_length=255, source_field='name'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='title_search_key',
+            field=backend.search.SearchKeyField(blank=True, default='', editable=False, max_length=255, source_field='title'),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['search_key'], name='author_search_key_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['created_by', 'title_search_key'], name='book_title_search_key_idx', opclasses=['uuid_ops', 'varchar_pattern_ops']),
+        ),
+    ]
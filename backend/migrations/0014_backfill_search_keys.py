@@ -0,0 +1,35 @@
+from django.db import migrations
+
+from backend.search import normalize_search_text, tokenize
+
+
+def backfill_search_keys(apps, schema_editor):
+    Author = apps.get_model('backend', 'Author')
+    Book = apps.get_model('backend', 'Book')
+    SearchDocument = apps.get_model('backend', 'SearchDocument')
+
+    for model, field, source in ((Author, 'search_key', 'name'), (Book, 'title_search_key', 'title')):
+        objs = []
+        for obj in model.objects.only('pk', source).iterator(chunk_size=1000):
+            setattr(obj, field, normalize_search_text(getattr(obj, source))[:255])
+            objs.append(obj)
+        model.objects.bulk_update(objs, [field], batch_size=1000)
+
+    # 正規化にカタカナ・ひらがなの統一を加えたため、全文検索用の文書も正規化し直す
+    # (正規化済みの文字列を正規化し直した結果は、元の文字列を新しい方法で正規化した結果と同じになる)
+    documents = []
+    for document in SearchDocument.objects.only('pk', 'text').iterator(chunk_size=1000):
+        document.text, document.tokens = normalize_search_text(document.text), ' '.join(tokenize(document.text))
+        documents.append(document)
+    SearchDocument.objects.bulk_update(documents, ['text', 'tokens'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_search_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+    ]
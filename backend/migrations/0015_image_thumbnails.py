@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_backfill_search_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_thumbnail',
+            field=models.URLField(blank=True, editable=False, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='quote_image_thumbnail',
+            field=models.URLField(blank=True, editable=False, max_length=500, null=True),
+        ),
+    ]
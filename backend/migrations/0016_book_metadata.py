@@ -0,0 +1,34 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookMetadata',
+            fields=[
+                ('id_google', models.CharField(max_length=12, primary_key=True, serialize=False)),
+                ('title', models.CharField(blank=True, default='', max_length=255)),
+                ('authors', models.JSONField(blank=True, default=list)),
+                ('thumbnail', models.URLField(blank=True, max_length=500, null=True)),
+                ('page_count', models.IntegerField(blank=True, null=True)),
+                ('amazon_dp', models.CharField(blank=True, max_length=13, null=True)),
+                ('found', models.BooleanField(default=True)),
+                ('fetched_at', models.DateTimeField()),
+                ('last_accessed_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'book_metadata',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bookmetadata',
+            index=models.Index(fields=['last_accessed_at'], name='book_metadata_accessed_idx'),
+        ),
+    ]
@@ -1,12 +1,20 @@
+import re
 import uuid
+from bisect import bisect_right
+from datetime import timedelta
 from django.core.validators import MinLengthValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
-from django.db.models import Max, F, Count
-from django.db.models.functions import Coalesce
+from django.db.models import F, Q, Count, Sum, Min, Max, OuterRef, Subquery, Case, When, Value, Prefetch
+from django.db.models.functions import Coalesce, Cast, Ceil, Greatest, Trunc, TruncDate
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 
+from .cache import bump_user_cache_version_on_commit
+from .images import prepare_thumbnail, schedule_thumbnail
+from .search import SearchKeyField, normalize_search_text, tokenize, get_match_expression
+from .tasks import run_in_background
+
 
 class CustomUser(AbstractUser):
     """ユーザーモデル"""
@@ -20,53 +28,219 @@ class CustomUser(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     email = models.EmailField(_('email address'), unique=True, blank=True)
     avatar = models.ImageField('写真', blank=True, null=True, default=None)
+    avatar_thumbnail = models.URLField(max_length=500, null=True, blank=True, editable=False)
 
     # EMAIL_FIELD = 'email'
     # USERNAME_FIELD = 'email'
     # REQUIRED_FIELDS = ['username']
 
+    def save(self, *args, **kwargs):
+        # 写真が差し替えられた場合は、保存後にサムネイルを生成する
+        generates_thumbnail = prepare_thumbnail(self, 'avatar', kwargs)
 
-class BookQuerySet(models.QuerySet):
-    def filter_by_state(self, state, exclude=False):
-        if not state:
-            return self
+        super().save(*args, **kwargs)
+
+        if generates_thumbnail:
+            schedule_thumbnail(self, 'avatar')
+
+
+STATE_CHOICES = (('to_be_read', 'To be read'), ('reading', 'Reading'), ('read', 'Read'))
+
+
+def get_state_expression(position='current_position'):
+    """位置から読書状態を求める式を取得"""
+
+    return Case(
+        When(**{f'{position}__lte': 0}, then=Value('to_be_read')),
+        When(**{f'{position}__lt': F('total')}, then=Value('reading')),
+        default=Value('read'),
+        output_field=models.CharField(),
+    )
 
-        queryset = self.prefetch_related('status_log').distinct()
-        ids = []
 
-        if state == 'all':
-            return queryset
+def prefetch_author_relations(lookup='bookauthorrelation_set'):
+    """著者の中間テーブルを著者名込みで、順番通りに先読みする"""
 
-        for book in queryset:
-            status_log = book.status_log
-            position = status_log.first().position if status_log.exists() else 0
+    return Prefetch(lookup, queryset=BookAuthorRelation.objects.select_related('author').order_by('order'))
 
-            if position <= 0:
-                if state == 'to_be_read':
-                    ids.append(book.id)
-                else:
-                    continue
-            else:
-                if state == 'reading' and position < book.total:
-                    ids.append(book.id)
-                elif state == 'read' and position >= book.total:
-                    ids.append(book.id)
+
+class BookQuerySet(models.QuerySet):
+    def filter_by_state(self, state, exclude=False):
+        if not state or state == 'all':
+            return self
 
         if exclude:
-            return queryset.exclude(id__in=ids)
+            return self.exclude(state=state)
         else:
-            return queryset.filter(id__in=ids)
+            return self.filter(state=state)
 
     def annotate_accessed_at(self):
-        return self.annotate(accessed_at=Coalesce(Max('status_log__created_at'), F('created_at')))
+        return self.annotate(accessed_at=F('last_accessed_at'))
 
     def sort_by_accessed_at(self):
         return self.annotate_accessed_at().order_by('-accessed_at')
 
+    def prefetch_authors(self):
+        return self.prefetch_related(prefetch_author_relations())
+
+    def prefetch_status_log(self):
+        """ステータスを直前の位置つきで先読み"""
+
+        return self.prefetch_related(
+            Prefetch('status_log', queryset=StatusLog.objects.annotate_prev_position().order_by('-created_at'))
+        )
+
+    def prefetch_notes(self):
+        return self.prefetch_related(Prefetch('notes', queryset=Note.objects.order_by('position')))
+
+    def annotate_progress_position(self):
+        """直近の0より大きい位置をアノテーション (積読に戻した本の進捗表示用)"""
+
+        latest_status = StatusLog.objects.filter(book=OuterRef('pk'), position__gt=0).order_by('-created_at')
+        return self.annotate(progress_position=Coalesce(Subquery(latest_status.values('position')[:1]), 0))
+
+    def refresh_reading_state(self):
+        """ステータスの履歴から現在の位置・読書状態・最終アクセス日を再計算"""
+
+        latest_status = StatusLog.objects.filter(book=OuterRef('pk')).order_by('-created_at')
+        self.update(
+            current_position=Coalesce(Subquery(latest_status.values('position')[:1]), 0),
+            last_accessed_at=Coalesce(Subquery(latest_status.values('created_at')[:1]), F('created_at')),
+        )
+        # 更新後の位置から読書状態を求め、著者の集計に反映する
+        count = self.update(state=get_state_expression())
+        AuthorSummary.objects.refresh_books(self)
+
+        for user_id in self.order_by().values_list('created_by', flat=True).distinct():
+            bump_user_cache_version_on_commit(user_id)
+        return count
+
+    def bulk_import(self, user, rows):
+        """
+        書籍をステータスの履歴ごとまとめて登録
+        (rowsは書籍のフィールドに authors: 著者名のリスト, status: [{position, created_at}] を加えた辞書)
+
+        同一ユーザー・同一のGoogle Books IDの書籍がすでに存在する場合は登録しない。
+        登録した書籍と、スキップした行の (インデックス, 既存の書籍) のリストを返す。
+        """
+
+        existing = {book.id_google: book for book in self.filter(created_by=user, id_google__in={row['id_google'] for row in rows})}
+        authors = Author.objects.get_or_create_by_names(name for row in rows for name in row['authors'])
+
+        books, relations, status_log, skipped = [], [], [], []
+        for index, row in enumerate(rows):
+            row = dict(row)
+            if row['id_google'] in existing:
+                skipped.append((index, existing[row['id_google']]))
+                continue
+
+            author_names, status_rows = row.pop('authors'), row.pop('status', [])
+            book = Book(created_by=user, **row)
+            book.last_accessed_at = book.created_at
+            existing[book.id_google] = book
+            books.append(book)
+
+            relations += [BookAuthorRelation(book=book, author=authors[name], order=i) for i, name in enumerate(author_names)]
+            status_log += [StatusLog(book=book, created_by=user, **status) for status in status_rows]
+
+        with transaction.atomic():
+            self.bulk_create(books, batch_size=500)
+            BookAuthorRelation.objects.bulk_create(relations, batch_size=500)
+            StatusLog.objects.bulk_create(status_log, batch_size=500)
+
+            # save()を経由しないため、読書状態・検索インデックス・日毎の集計をまとめて更新する
+            Book.objects.filter(pk__in=[book.pk for book in books]).refresh_reading_state()
+            SearchDocument.objects.index_books(books)
+            DailyReadingStats.objects.refresh(user, {timezone.localdate(status.created_at) for status in status_log})
+
+        return books, skipped
+
+
+def normalize_author_name(name):
+    """著者名の正規化 (全角スペースを半角に、漢字・かなの間のスペースを除去)"""
+
+    name = name.replace('　', ' ')
+    return re.sub(r'(?<=[亜-熙ぁ-んァ-ヶ]) (?=[亜-熙ぁ-んァ-ヶ])', '', name)
+
 
 class AuthorQuerySet(models.QuerySet):
     def sort_by_books_count(self):
-        return self.annotate(Count('books')).order_by('-books__count')
+        return self.annotate(Count('books')).order_by('-books__count', 'name')
+
+    def get_or_create_by_names(self, names):
+        """著者名からAuthorをまとめて取得・作成 (著者名: Authorの辞書を返す)"""
+
+        names = set(names)
+        authors = {author.name: author for author in self.filter(name__in=names)}
+        created = self.bulk_create([Author(name=name) for name in names if name not in authors], batch_size=500)
+        authors.update({author.name: author for author in created})
+
+        return authors
+
+    def mark_for_cleanup(self, author_ids):
+        """書籍との紐付けが外れた著者を削除待ちにする (孤立した著者はバックグラウンドで削除)"""
+
+        author_ids = set(author_ids)
+        if not author_ids:
+            return
+
+        PendingAuthorCleanup.objects.bulk_create(
+            [PendingAuthorCleanup(author_id=author_id) for author_id in author_ids], ignore_conflicts=True
+        )
+        run_in_background(Author.objects.delete_orphans, name='delete_orphan_authors')
+
+    def delete_orphans(self, batch_size=500):
+        """削除待ちの著者のうち、書籍に紐付いていないものをbatch_sizeずつ削除 (削除した件数を返す)"""
+
+        total = 0
+        while True:
+            pending = list(PendingAuthorCleanup.objects.order_by('created_at').values_list('pk', 'author_id')[:batch_size])
+            if not pending:
+                break
+
+            with transaction.atomic():
+                _, deleted = self.filter(pk__in=[author_id for _, author_id in pending], books=None).delete()
+                PendingAuthorCleanup.objects.filter(pk__in=[pk for pk, _ in pending]).delete()
+            total += deleted.get(Author._meta.label, 0)
+
+        return total
+
+    def merge_duplicates(self):
+        """正規化した著者名が同じ著者を1つにまとめる (紐付けを変更した書籍のIDを返す)"""
+
+        groups = {}
+        for pk, name in self.order_by('name', 'pk').values_list('pk', 'name').iterator():
+            groups.setdefault(normalize_author_name(name), []).append((pk, name))
+
+        book_ids = set()
+        for name, authors in groups.items():
+            if len(authors) == 1 and authors[0][1] == name:
+                continue
+
+            # 正規化済みの著者名のものを優先して残す
+            authors.sort(key=lambda author: author[1] != name)
+            author_id, duplicate_ids = authors[0][0], [pk for pk, _ in authors[1:]]
+
+            with transaction.atomic():
+                relations = BookAuthorRelation.objects.filter(author_id__in=[pk for pk, _ in authors])
+                book_ids.update(relations.values_list('book_id', flat=True))
+
+                for duplicate_id in duplicate_ids:
+                    # すでに同じ書籍に紐付いている場合は中間テーブルを削除し、それ以外は付け替える
+                    BookAuthorRelation.objects.filter(
+                        author_id=duplicate_id,
+                        book__in=BookAuthorRelation.objects.filter(author_id=author_id).values('book')
+                    ).delete()
+                    BookAuthorRelation.objects.filter(author_id=duplicate_id).update(author_id=author_id)
+
+                self.filter(pk__in=duplicate_ids).delete()
+                self.filter(pk=author_id).exclude(name=name).update(name=name, search_key=normalize_search_text(name))
+
+        # 著者名の変わった書籍のユーザーのキャッシュを無効化する
+        for user_id in Book.objects.filter(pk__in=book_ids).order_by().values_list('created_by', flat=True).distinct():
+            bump_user_cache_version_on_commit(user_id)
+
+        return book_ids
 
 
 class Author(models.Model):
@@ -74,24 +248,57 @@ class Author(models.Model):
     class Meta:
         db_table = 'author'
         ordering = ['-name']
+        indexes = [
+            # 検索キーの前方一致 (LIKE 'x%') はロケールによらずインデックスを使えるよう、pattern_opsで作成する (PostgreSQL)
+            models.Index(fields=['search_key'], name='author_search_key_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
+    search_key = SearchKeyField(source_field='name')
     objects = AuthorQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        # 著者名の変更は、その著者の書籍を持つすべてのユーザーのレスポンスに影響する
+        for user_id in self.books.order_by().values_list('created_by', flat=True).distinct():
+            bump_user_cache_version_on_commit(user_id)
+
+
+class PendingAuthorCleanup(models.Model):
+    """削除待ちの著者 (書籍との紐付けが外れた著者。孤立していればAuthor.objects.delete_orphansで削除する)"""
+
+    class Meta:
+        db_table = 'pending_author_cleanup'
+
+    author_id = models.UUIDField(unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
 
 class Book(models.Model):
 
     class Meta:
         db_table = 'book'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_by', 'state'], name='book_created_by_state_idx'),
+            models.Index(fields=['created_by', '-last_accessed_at'], name='book_created_by_accessed_idx'),
+            models.Index(
+                fields=['created_by', 'title_search_key'], name='book_title_search_key_idx', opclasses=['uuid_ops', 'varchar_pattern_ops']
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['created_by', 'id_google'], name='book_created_by_id_google_unique'),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     id_google = models.CharField(max_length=12)
     title = models.CharField(max_length=100)
+    title_search_key = SearchKeyField(source_field='title')
     authors = models.ManyToManyField(Author, related_name='books', through='BookAuthorRelation')
     thumbnail = models.URLField(null=True, blank=True)
     format_type = models.IntegerField(default=0, choices=((0, 'normal'), (1, 'ebook')))
@@ -100,12 +307,87 @@ class Book(models.Model):
     amazon_dp = models.CharField(max_length=13, validators=[MinLengthValidator(10)], null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, related_name='books')
+
+    # ステータスの履歴から求めた値 (StatusLogの保存・削除時に更新)
+    current_position = models.IntegerField(default=0)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='to_be_read')
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+
     objects = BookQuerySet.as_manager()
 
     def __str__(self):
         return '{}: {}'.format(self.created_by, self.title)
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+
+        # 総数・ページ数・形式が変更された場合、ページ数の集計をやり直す
+        prev = None
+        if not self._state.adding and (update_fields is None or {'total', 'total_page', 'format_type'} & {*update_fields}):
+            prev = Book.objects.filter(pk=self.pk).values('total', 'total_page', 'format_type', 'state').first()
+        refresh_stats = prev is not None and (prev['total'], prev['total_page'], prev['format_type']) != (
+            self.total, self.total_page, self.format_type
+        )
+
+        # 総数の変更に合わせて読書状態を更新
+        if self.current_position <= 0:
+            self.state = 'to_be_read'
+        elif self.current_position < self.total:
+            self.state = 'reading'
+        else:
+            self.state = 'read'
+
+        if self.last_accessed_at is None:
+            self.last_accessed_at = self.created_at
+
+        # 読書状態が変わった場合、著者の集計を更新する
+        refresh_summary = prev is not None and prev['state'] != self.state
+
+        if update_fields is not None and 'total' in update_fields:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'state'}
+        if update_fields is not None and 'title' in update_fields:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'title_search_key'}
+
+        super().save(*args, **kwargs)
+
+        if update_fields is None or 'title' in update_fields:
+            SearchDocument.objects.index_book(self, fields=['title'])
+
+        if refresh_stats:
+            DailyReadingStats.objects.refresh(self.created_by, self.status_log.values_list('created_at__date', flat=True))
+
+        if refresh_summary:
+            AuthorSummary.objects.refresh_books([self.pk])
+
+        bump_user_cache_version_on_commit(self.created_by_id)
+
+    def delete(self, *args, **kwargs):
+        dates = list(self.status_log.values_list('created_at__date', flat=True).distinct())
+        author_ids = list(self.bookauthorrelation_set.values_list('author_id', flat=True))
+        ret = super().delete(*args, **kwargs)
+        DailyReadingStats.objects.refresh(self.created_by, dates)
+        AuthorSummary.objects.refresh(self.created_by, author_ids)
+        Author.objects.mark_for_cleanup(author_ids)
+        bump_user_cache_version_on_commit(self.created_by_id)
+        return ret
+
+    def update_reading_state(self):
+        """最新のステータスから現在の位置・読書状態・最終アクセス日を更新"""
+
+        prev_state = self.state
+        latest_status = self.status_log.order_by('-created_at').first()
+        self.current_position = latest_status.position if latest_status else 0
+        self.last_accessed_at = latest_status.created_at if latest_status else self.created_at
+        self.save(update_fields=['current_position', 'state', 'last_accessed_at'])
+
+        if self.state != prev_state:
+            AuthorSummary.objects.refresh_books([self.pk])
+
     def get_author_names(self):
+        # 先読み済みの場合はキャッシュを使う
+        if 'bookauthorrelation_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return [relation.author.name for relation in self.bookauthorrelation_set.all()]
+
         # orderに合わせて著者名を並び替え
         through = self.authors.through
         return through.objects.filter(book=self).values_list('author__name', flat=True).order_by('order')
@@ -116,6 +398,9 @@ class BookAuthorRelation(models.Model):
     class Meta:
         db_table = 'book_author'
         ordering = ['book', 'order']
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'order'], name='book_author_book_order_unique'),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
@@ -128,25 +413,476 @@ class Note(models.Model):
     class Meta:
         db_table = 'note'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_by', '-created_at', '-id'], name='note_created_by_at_idx'),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='notes')
     position = models.IntegerField()
     quote_text = models.TextField(null=True, blank=True)
     quote_image = models.ImageField(blank=True, null=True, default=None)
+    quote_image_thumbnail = models.URLField(max_length=500, null=True, blank=True, editable=False)
     content = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, related_name='notes')
 
+    def save(self, *args, **kwargs):
+        # 引用画像が差し替えられた場合は、保存後にサムネイルを生成する
+        generates_thumbnail = prepare_thumbnail(self, 'quote_image', kwargs)
+
+        super().save(*args, **kwargs)
+        SearchDocument.objects.index_note(self)
+        bump_user_cache_version_on_commit(self.created_by_id)
+
+        if generates_thumbnail:
+            schedule_thumbnail(self, 'quote_image')
+
+    def delete(self, *args, **kwargs):
+        ret = super().delete(*args, **kwargs)
+        bump_user_cache_version_on_commit(self.created_by_id)
+        return ret
+
+
+class StatusLogQuerySet(models.QuerySet):
+    def bulk_record(self, user, status_log):
+        """ステータスをまとめて登録し、書籍の読書状態と日毎の集計を更新 (save()を経由しない一括登録用)"""
+
+        status_log = list(status_log)
+        if not status_log:
+            return status_log
+
+        book_ids = {status.book_id for status in status_log}
+
+        with transaction.atomic():
+            self.bulk_create(status_log, batch_size=500)
+            Book.objects.filter(pk__in=book_ids).refresh_reading_state()
+
+            # 登録したステータスの日付と、同じ書籍の次の進捗の日付の集計が変わる
+            dates = {timezone.localdate(status.created_at) for status in status_log}
+            oldest = min(status.created_at for status in status_log)
+            following = self.filter(book_id__in=book_ids, created_at__gt=oldest, position__gt=0) \
+                .order_by('created_at').values_list('book_id', 'created_at')
+            following_by_book = {}
+            for book_id, created_at in following:
+                following_by_book.setdefault(book_id, []).append(created_at)
+            for status in status_log:
+                created_at_list = following_by_book.get(status.book_id, [])
+                i = bisect_right(created_at_list, status.created_at)
+                if i < len(created_at_list):
+                    dates.add(timezone.localdate(created_at_list[i]))
+
+            DailyReadingStats.objects.refresh(user, dates)
+
+        return status_log
+
+    def annotate_prev_position(self):
+        """同じ書籍の直前のステータスのうち、0より大きい位置をアノテーション (ない場合は0)"""
+
+        prev_status = StatusLog.objects.filter(
+            book=OuterRef('book'), created_at__lt=OuterRef('created_at'), position__gt=0
+        ).order_by('-created_at')
+        return self.annotate(prev_position=Coalesce(Subquery(prev_status.values('position')[:1]), 0))
+
+    def annotate_diff(self):
+        """直前の位置から進んだ位置 (diff_value) とページ数 (diff_page) をアノテーション"""
+
+        # Kindle本の場合は、位置Noの割合から総ページ数に換算する
+        # (サブクエリが何度も展開されないよう、diff_valueの参照は1箇所にまとめる)
+        is_kindle = Q(book__format_type=1)
+        numerator = Case(When(is_kindle, then=F('book__total_page')), default=Value(1))
+        denominator = Case(When(is_kindle, then=F('book__total')), default=Value(1))
+
+        return self.annotate_prev_position().annotate(
+            diff_value=Greatest(F('position') - F('prev_position'), Value(0)),
+        ).annotate(diff_page=Cast(
+            Ceil(Cast(F('diff_value') * numerator, models.FloatField()) / denominator),
+            models.IntegerField(),
+        ))
+
+    def sum_pages_by_date(self, kind='day'):
+        """日付 (day/week/month単位) ごとに進んだページ数を集計"""
+
+        # 検索フィルタの結合による重複を避けるため、サブクエリで絞り込んでから集計する
+        queryset = StatusLog.objects.filter(pk__in=self.values('pk'))
+        if kind == 'day':
+            date = TruncDate('created_at')
+        else:
+            date = Trunc('created_at', kind, output_field=models.DateField())
+
+        return queryset.annotate_diff().annotate(date=date).order_by('-date').values('date').annotate(pages=Sum('diff_page'))
+
 
 class StatusLog(models.Model):
 
     class Meta:
         db_table = 'status_log'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_by', '-created_at', '-id'], name='status_log_created_by_at_idx'),
+            models.Index(fields=['book', '-created_at'], name='status_log_book_at_idx'),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='status_log')
     position = models.IntegerField()
     created_at = models.DateTimeField(default=timezone.now)
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, related_name='status_log')
+    objects = StatusLogQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # 変更前の書籍・日時 (書籍が付け替えられた場合や、日時が変わった場合に再計算する)
+        prev = None
+        if not self._state.adding:
+            prev = StatusLog.objects.filter(pk=self.pk).values('book_id', 'created_at').first()
+
+        super().save(*args, **kwargs)
+
+        self.book.update_reading_state()
+        if prev and prev['book_id'] != self.book_id:
+            Book.objects.filter(pk=prev['book_id']).refresh_reading_state()
+
+        dates = self._get_affected_dates(self.book_id, self.created_at)
+        if prev:
+            dates += self._get_affected_dates(prev['book_id'], prev['created_at'])
+        DailyReadingStats.objects.refresh(self.created_by, dates)
+
+    def delete(self, *args, **kwargs):
+        ret = super().delete(*args, **kwargs)
+        self.book.update_reading_state()
+        DailyReadingStats.objects.refresh(self.created_by, self._get_affected_dates(self.book_id, self.created_at))
+        return ret
+
+    def _get_affected_dates(self, book_id, created_at):
+        """指定された書籍・日時のステータスの変更で、集計が変わる日付 (当日と、同じ本の次の進捗の日付)"""
+
+        next_status = StatusLog.objects.filter(book_id=book_id, created_at__gt=created_at, position__gt=0) \
+            .order_by('created_at').values_list('created_at', flat=True).first()
+        return [timezone.localdate(created_at), next_status and timezone.localdate(next_status)]
+
+
+class DailyReadingStatsQuerySet(models.QuerySet):
+    def _aggregate(self, user, dates=None):
+        """ステータスの履歴から日毎の集計を取得"""
+
+        status_log = StatusLog.objects.filter(created_by=user)
+        if dates is not None:
+            status_log = status_log.filter(created_at__date__in=dates)
+
+        return status_log.annotate_diff().annotate(date=TruncDate('created_at')).order_by().values('date').annotate(
+            pages=Sum('diff_page'),
+            status_count=Count('id', filter=Q(position__gt=0)),
+            books_to_be_read=Count('book', distinct=True, filter=Q(position=0)),
+            books_reading=Count('book', distinct=True, filter=Q(position__gt=0, position__lt=F('book__total'))),
+            books_read=Count('book', distinct=True, filter=Q(position__gte=F('book__total'))),
+            first_activity_at=Min('created_at'),
+            last_activity_at=Max('created_at'),
+        )
+
+    def refresh(self, user, dates):
+        """指定された日付の集計を再計算"""
+
+        dates = {date for date in dates if date is not None}
+        if user is None or not dates:
+            return
+
+        with transaction.atomic():
+            self.filter(user=user, date__in=dates).delete()
+            self.bulk_create([DailyReadingStats(user=user, **row) for row in self._aggregate(user, dates)])
+        bump_user_cache_version_on_commit(user)
+
+    def rebuild(self, user):
+        """ユーザーの集計をすべて再計算"""
+
+        with transaction.atomic():
+            self.filter(user=user).delete()
+            stats = self.bulk_create([DailyReadingStats(user=user, **row) for row in self._aggregate(user)])
+        bump_user_cache_version_on_commit(user)
+        return stats
+
+
+class DailyReadingStats(models.Model):
+    """ユーザーごとの日毎の読書記録の集計 (StatusLogの保存・削除時に更新)"""
+
+    class Meta:
+        db_table = 'daily_reading_stats'
+        ordering = ['user_id', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='daily_reading_stats_user_date_unique'),
+        ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='daily_reading_stats')
+    date = models.DateField()
+    pages = models.IntegerField(default=0)
+    status_count = models.IntegerField(default=0)
+    books_to_be_read = models.IntegerField(default=0)
+    books_reading = models.IntegerField(default=0)
+    books_read = models.IntegerField(default=0)
+    first_activity_at = models.DateTimeField()
+    last_activity_at = models.DateTimeField()
+    objects = DailyReadingStatsQuerySet.as_manager()
+
+    def __str__(self):
+        return '{}: {}'.format(self.user, self.date)
+
+
+class AuthorSummaryQuerySet(models.QuerySet):
+    def _aggregate(self, user, author_ids=None):
+        """書籍と著者の紐付けから、第一著者ごとの冊数を取得"""
+
+        relations = BookAuthorRelation.objects.filter(book__created_by=user, order=0)
+        if author_ids is not None:
+            relations = relations.filter(author_id__in=author_ids)
+
+        return relations.order_by().values('author_id').annotate(
+            books_count=Count('book'),
+            books_to_be_read=Count('book', filter=Q(book__state='to_be_read')),
+            books_reading=Count('book', filter=Q(book__state='reading')),
+            books_read=Count('book', filter=Q(book__state='read')),
+        )
+
+    def refresh(self, user, author_ids):
+        """指定された著者の集計を再計算 (userはユーザーまたはそのID)"""
+
+        author_ids = set(author_ids)
+        if user is None or not author_ids:
+            return
+
+        user_id = getattr(user, 'pk', user)
+        with transaction.atomic():
+            self.filter(user_id=user_id, author_id__in=author_ids).delete()
+            self.bulk_create([AuthorSummary(user_id=user_id, **row) for row in self._aggregate(user_id, author_ids)])
+        bump_user_cache_version_on_commit(user_id)
+
+    def refresh_books(self, books):
+        """指定された書籍 (書籍のIDのリストまたはquerysetで指定) の第一著者の集計を再計算"""
+
+        author_ids_by_user = {}
+        for user_id, author_id in BookAuthorRelation.objects.filter(book__in=books, order=0) \
+                .order_by().values_list('book__created_by', 'author_id').distinct():
+            author_ids_by_user.setdefault(user_id, set()).add(author_id)
+
+        for user_id, author_ids in author_ids_by_user.items():
+            self.refresh(user_id, author_ids)
+
+    def rebuild(self, user):
+        """ユーザーの集計をすべて再計算"""
+
+        with transaction.atomic():
+            self.filter(user=user).delete()
+            summary = self.bulk_create([AuthorSummary(user=user, **row) for row in self._aggregate(user)])
+        bump_user_cache_version_on_commit(user)
+        return summary
+
+    def sort_by_books_count(self, state=None, exclude=False):
+        """冊数の多い順に並び替え (stateを指定した場合はその読書状態の冊数、excludeの場合はそれ以外の冊数で数える)"""
+
+        count = F('books_count')
+        if state:
+            count = F('books_count') - F(f'books_{state}') if exclude else F(f'books_{state}')
+
+        return self.annotate(count=count).filter(count__gt=0).select_related('author').order_by('-count', 'author__name')
+
+
+class AuthorSummary(models.Model):
+    """ユーザーごとの著者の集計 (第一著者として登録した書籍の冊数。書籍・著者の紐付け・読書状態の更新時に更新)"""
+
+    class Meta:
+        db_table = 'author_summary'
+        ordering = ['user_id', '-books_count']
+        indexes = [
+            models.Index(fields=['user', '-books_count'], name='author_summary_user_count_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'], name='author_summary_user_author_unique'),
+        ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='author_summary')
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='summary')
+    books_count = models.IntegerField(default=0)
+    books_to_be_read = models.IntegerField(default=0)
+    books_reading = models.IntegerField(default=0)
+    books_read = models.IntegerField(default=0)
+    objects = AuthorSummaryQuerySet.as_manager()
+
+    def __str__(self):
+        return '{}: {}'.format(self.user, self.author)
+
+
+SEARCH_FIELDS = (('title', 'Title'), ('authors', 'Authors'), ('content', 'Content'), ('quote_text', 'Quote'))
+
+
+class SearchDocumentQuerySet(models.QuerySet):
+    def _replace(self, documents, **lookups):
+        """指定された対象の文書を置き換える"""
+
+        with transaction.atomic():
+            self.filter(**lookups).delete()
+            self.bulk_create(documents)
+
+    def _make_documents(self, values, **kwargs):
+        return [
+            SearchDocument(text=normalize_search_text(value), tokens=' '.join(tokenize(value)), **kwargs)
+            for value in values if normalize_search_text(value)
+        ]
+
+    def index_book(self, book, fields=('title', 'authors')):
+        """書籍のタイトル・著者名をインデックスに登録"""
+
+        documents = []
+        if 'title' in fields:
+            documents += self._make_documents([book.title], book=book, field='title', created_by=book.created_by)
+        if 'authors' in fields:
+            # 著者名をまたいで一致しないよう、著者ごとに文書を分ける
+            documents += self._make_documents(book.get_author_names(), book=book, field='authors', created_by=book.created_by)
+
+        self._replace(documents, book=book, field__in=fields)
+
+    def index_books(self, books):
+        """複数の書籍のタイトル・著者名をまとめてインデックスに登録"""
+
+        books = list(books)
+        models.prefetch_related_objects(books, prefetch_author_relations())
+
+        documents = []
+        for book in books:
+            documents += self._make_documents([book.title], book=book, field='title', created_by=book.created_by)
+            documents += self._make_documents(book.get_author_names(), book=book, field='authors', created_by=book.created_by)
+
+        with transaction.atomic():
+            for i in range(0, len(books), 500):
+                self.filter(book__in=books[i:i + 500], field__in=('title', 'authors')).delete()
+            self.bulk_create(documents, batch_size=500)
+
+    def index_note(self, note):
+        """メモの本文・引用をインデックスに登録"""
+
+        documents = self._make_documents([note.content], note=note, field='content', created_by=note.created_by) \
+            + self._make_documents([note.quote_text], note=note, field='quote_text', created_by=note.created_by)
+        self._replace(documents, note=note)
+
+    def index_notes(self, notes):
+        """複数のメモの本文・引用をまとめてインデックスに登録"""
+
+        notes = list(notes)
+        documents = []
+        for note in notes:
+            documents += self._make_documents([note.content], note=note, field='content', created_by=note.created_by)
+            documents += self._make_documents([note.quote_text], note=note, field='quote_text', created_by=note.created_by)
+
+        with transaction.atomic():
+            for i in range(0, len(notes), 500):
+                self.filter(note__in=notes[i:i + 500]).delete()
+            self.bulk_create(documents, batch_size=500)
+
+    def search(self, field, word, user=None):
+        """フリーワードに一致する書籍 or メモのIDを取得 (インデックスが使えない場合はNone)"""
+
+        match = get_match_expression(word)
+        if match is None:
+            return None
+
+        queryset = self.filter(id__in=match, field=field)
+        if user is not None:
+            queryset = queryset.filter(created_by=user)
+
+        target = 'book_id' if field in ('title', 'authors') else 'note_id'
+        return queryset.values(target)
+
+
+class SearchDocument(models.Model):
+    """全文検索用のインデックス (書籍のタイトル・著者名、メモの本文・引用)"""
+
+    class Meta:
+        db_table = 'search_document'
+        indexes = [
+            models.Index(fields=['book', 'field'], name='search_document_book_idx'),
+            models.Index(fields=['note', 'field'], name='search_document_note_idx'),
+        ]
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True, related_name='search_documents')
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, null=True, related_name='search_documents')
+    field = models.CharField(max_length=10, choices=SEARCH_FIELDS)
+    text = models.TextField()
+    tokens = models.TextField()
+    created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, related_name='search_documents')
+    objects = SearchDocumentQuerySet.as_manager()
+
+
+class BookMetadataQuerySet(models.QuerySet):
+    def store(self, fetched, fetched_at):
+        """Google Books APIから取得した情報をまとめて保存 (fetchedはID: 情報の辞書。見つからなかったIDの情報はNone)"""
+
+        rows = [
+            BookMetadata(id_google=id_google, found=data is not None, fetched_at=fetched_at, last_accessed_at=fetched_at, **(data or {}))
+            for id_google, data in fetched.items()
+        ]
+        if not rows:
+            return {}
+
+        with transaction.atomic():
+            existing = set(self.filter(pk__in=[row.pk for row in rows]).values_list('pk', flat=True))
+            self.bulk_update(
+                [row for row in rows if row.pk in existing],
+                ['title', 'authors', 'thumbnail', 'page_count', 'amazon_dp', 'found', 'fetched_at', 'last_accessed_at'],
+            )
+            # 他のプロセスが同時に同じ書籍を登録した場合は、そちらを残す
+            self.bulk_create([row for row in rows if row.pk not in existing], ignore_conflicts=True)
+
+        return {row.pk: row for row in rows}
+
+    def touch(self, ids, accessed_at, interval=timedelta(hours=1)):
+        """最終アクセス日時を更新 (書き込みを減らすため、intervalより前にアクセスされたものだけ)"""
+
+        if ids:
+            self.filter(pk__in=ids, last_accessed_at__lt=accessed_at - interval).update(last_accessed_at=accessed_at)
+
+    def evict(self, max_entries, batch_size=500):
+        """最終アクセス日時が古いものから、max_entries件を超えた分をbatch_sizeずつ削除 (削除した件数を返す)"""
+
+        total = 0
+        while True:
+            # まとめて取得した書籍は最終アクセス日時が同じになるため、日時ではなく順位で削除する対象を決める
+            ids = list(self.order_by('-last_accessed_at', 'pk').values_list('pk', flat=True)[max_entries:max_entries + batch_size])
+            if not ids:
+                return total
+
+            deleted, _ = self.filter(pk__in=ids).delete()
+            total += deleted
+
+
+class BookMetadata(models.Model):
+    """Google Books APIから取得した書籍の情報のキャッシュ (Google Books IDごとに、全ユーザーで共有)"""
+
+    class Meta:
+        db_table = 'book_metadata'
+        indexes = [
+            models.Index(fields=['last_accessed_at'], name='book_metadata_accessed_idx'),
+        ]
+
+    id_google = models.CharField(max_length=12, primary_key=True)
+    title = models.CharField(max_length=255, blank=True, default='')
+    authors = models.JSONField(default=list, blank=True)
+    thumbnail = models.URLField(max_length=500, null=True, blank=True)
+    page_count = models.IntegerField(null=True, blank=True)
+    amazon_dp = models.CharField(max_length=13, null=True, blank=True)
+    # Google Books APIで見つからなかった書籍も、問い合わせを繰り返さないよう記録する
+    found = models.BooleanField(default=True)
+    fetched_at = models.DateTimeField()
+    last_accessed_at = models.DateTimeField()
+    objects = BookMetadataQuerySet.as_manager()
+
+    def __str__(self):
+        return '{}: {}'.format(self.id_google, self.title)
+
+    def get_book_data(self, format_type=0):
+        """Bookの登録に使うデータを取得 (ページ数は、通常の書籍は総数・Kindle本はページ数に使う)"""
+
+        data = {
+            'title': self.title[:Book._meta.get_field('title').max_length],
+            'authors': [name[:100] for name in self.authors],
+            'thumbnail': self.thumbnail,
+            'amazon_dp': self.amazon_dp,
+            'total_page' if format_type == 1 else 'total': self.page_count,
+        }
+        return {key: value for key, value in data.items() if value}
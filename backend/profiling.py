@@ -0,0 +1,226 @@
+"""
+リクエストごとのSQL・シリアライズのプロファイリング
+
+サンプリングされたリクエストについて、クエリ数・DBの処理時間・遅いSQL・シリアライズの時間・ビューの処理時間を記録し、
+構造化したログとServer-Timingヘッダに出力する。エンドポイントごとの処理時間は、プロセス内に直近の分だけ保持する。
+シリアライズの時間は、ProfilingSerializerMixinを付けたシリアライザのto_representationの時間を合計する。
+"""
+
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from threading import Lock
+import heapq
+import json
+import logging
+import random
+import time
+
+logger = logging.getLogger('yomlog.profiling')
+
+# 処理時間のヒストグラムの区切り (ミリ秒)
+HISTOGRAM_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_current_profile = ContextVar('current_profile', default=None)
+
+
+def get_profiling_setting(name):
+    defaults = {
+        'ENABLED': False, 'SAMPLE_RATE': 0.0, 'SLOW_QUERIES': 5, 'SERVER_TIMING': False, 'WINDOW': 500, 'ALLOW_FORCE': False,
+    }
+    return getattr(settings, 'PROFILING', {}).get(name, defaults[name])
+
+
+class RequestProfile():
+    """1リクエスト分の計測値"""
+
+    def __init__(self, slow_queries_count):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.view_start = None
+        self.view_time = 0.0
+        self.slow_queries_count = slow_queries_count
+        self._slow_queries = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.db_time += duration
+
+            # 遅いSQLを上位N件だけ保持する
+            item = (duration, self.query_count, sql)
+            if len(self._slow_queries) < self.slow_queries_count:
+                heapq.heappush(self._slow_queries, item)
+            elif self.slow_queries_count:
+                heapq.heappushpop(self._slow_queries, item)
+
+    @property
+    def slow_queries(self):
+        return [
+            {'sql': sql[:300], 'ms': round(duration * 1000, 2)}
+            for duration, _, sql in sorted(self._slow_queries, reverse=True)
+        ]
+
+
+class ProfilingSerializerMixin():
+    """シリアライズ (to_representation) にかかった時間を計測するミックスイン (入れ子のシリアライザは外側でまとめて計測)"""
+
+    def to_representation(self, instance):
+        profile = _current_profile.get()
+        if profile is None or profile.serializer_depth:
+            return super().to_representation(instance)
+
+        profile.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.serializer_time += time.perf_counter() - start
+            profile.serializer_depth -= 1
+
+
+class EndpointStats():
+    """エンドポイントごとの直近の処理時間 (プロセス内)"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=get_profiling_setting('WINDOW')))
+
+    def add(self, endpoint, record):
+        with self._lock:
+            self._durations[endpoint].append((record['total_ms'], record['db_ms'], record['queries']))
+
+    def clear(self):
+        with self._lock:
+            self._durations.clear()
+
+    def summary(self):
+        with self._lock:
+            items = {endpoint: list(durations) for endpoint, durations in self._durations.items()}
+
+        ret = {}
+        for endpoint, records in items.items():
+            totals = sorted(record[0] for record in records)
+            histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+            for total in totals:
+                histogram[next((i for i, bucket in enumerate(HISTOGRAM_BUCKETS) if total <= bucket), -1)] += 1
+
+            ret[endpoint] = {
+                'count': len(records),
+                'total_ms': {
+                    'p50': _percentile(totals, 50),
+                    'p95': _percentile(totals, 95),
+                    'p99': _percentile(totals, 99),
+                    'max': totals[-1],
+                },
+                'db_ms_avg': round(sum(record[1] for record in records) / len(records), 2),
+                'queries_avg': round(sum(record[2] for record in records) / len(records), 2),
+                'queries_max': max(record[2] for record in records),
+                'histogram': {
+                    **{f'<={bucket}': count for bucket, count in zip(HISTOGRAM_BUCKETS, histogram)},
+                    f'>{HISTOGRAM_BUCKETS[-1]}': histogram[-1],
+                },
+            }
+
+        return ret
+
+
+def _percentile(values, percent):
+    index = min(len(values) - 1, max(0, round(len(values) * percent / 100) - 1))
+    return values[index]
+
+
+endpoint_stats = EndpointStats()
+
+
+class ProfilingMiddleware():
+    """
+    サンプリングしたリクエストのSQL・シリアライズの処理時間を記録するミドルウェア
+
+    X-Profileヘッダを付けたスタッフユーザーのリクエストは、サンプリングに関わらず記録してServer-Timingヘッダを返す。
+    (JWT認証のユーザーはビューの処理後に判明するため、ヘッダがあれば計測し、記録するかは処理後に判定する。
+    ALLOW_FORCEが有効な場合は、スタッフユーザー以外のヘッダも受け付ける)
+    (ストリーミングのレスポンスは、本文を返す間のクエリを含まない)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_profiling_setting('ENABLED'):
+            return self.get_response(request)
+
+        is_sampled = random.random() < get_profiling_setting('SAMPLE_RATE')
+        is_forced = 'HTTP_X_PROFILE' in request.META
+        if not is_sampled and not is_forced:
+            return self.get_response(request)
+
+        profile = RequestProfile(get_profiling_setting('SLOW_QUERIES'))
+        request._profile = profile
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        total_time = time.perf_counter() - start
+        if profile.view_start is not None:
+            profile.view_time = time.perf_counter() - profile.view_start
+
+        is_forced = is_forced and self.can_force(request)
+        if is_sampled or is_forced:
+            self.record(request, response, profile, total_time, is_forced)
+        return response
+
+    def can_force(self, request):
+        """X-Profileヘッダを受け付けるか (DRFで認証したユーザーも、処理後はrequest.userに入っている)"""
+
+        if get_profiling_setting('ALLOW_FORCE'):
+            return True
+
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            profile.view_start = time.perf_counter()
+
+    def record(self, request, response, profile, total_time, is_forced):
+        match = request.resolver_match
+        endpoint = '{} /{}'.format(request.method, match.route.strip('^$') if match else request.path_info.lstrip('/'))
+        record = {
+            'endpoint': endpoint,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.query_count,
+            'db_ms': round(profile.db_time * 1000, 2),
+            'serializer_ms': round(profile.serializer_time * 1000, 2),
+            'view_ms': round(profile.view_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+            'streaming': response.streaming,
+            'slow_queries': profile.slow_queries,
+        }
+
+        endpoint_stats.add(endpoint, record)
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+        if get_profiling_setting('SERVER_TIMING') or is_forced:
+            response['Server-Timing'] = ', '.join([
+                'db;dur={};desc="{} queries"'.format(record['db_ms'], record['queries']),
+                'serializer;dur={}'.format(record['serializer_ms']),
+                'view;dur={}'.format(record['view_ms']),
+                'total;dur={}'.format(record['total_ms']),
+            ])
@@ -0,0 +1,143 @@
+"""
+全文検索用のトークナイズ・検索バックエンド
+
+日本語の文章は単語の区切りがないため、正規化した文字列を2文字ずつのn-gram (bigram) に分割してインデックスする。
+検索語も同様に分割し、bigramが連続して現れる文書を探すことで部分一致検索を行う。
+"""
+
+from django.db import connection, models
+from django.db.models.expressions import RawSQL
+import re
+import unicodedata
+
+
+# 1文字の検索語はbigramのインデックスで検索できないため、正規化した検索キーの前方一致で検索する
+MIN_QUERY_LENGTH = 2
+
+# カタカナをひらがなに寄せる (ァ-ヶ、ヽヾ)
+KATAKANA_TO_HIRAGANA = {
+    **{code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)},
+    ord('ヽ'): ord('ゝ'),
+    ord('ヾ'): ord('ゞ'),
+}
+
+
+def normalize_search_text(text):
+    """検索用に文字列を正規化 (NFKCで全角・半角を統一、小文字化・カタカナをひらがなに、空白と記号の除去)"""
+
+    text = unicodedata.normalize('NFKC', text or '').lower().translate(KATAKANA_TO_HIRAGANA)
+    return re.sub(r'[\W_]+', '', text)
+
+
+def get_search_key_lookup(field_name, word):
+    """
+    正規化した検索キーのフィールドに対するlookupを取得 (正規化して空になる場合はNone)
+
+    bigramのインデックスで検索できない1文字の検索語は、検索キーのインデックスを使える前方一致で検索する。
+    全文検索のバックエンドがないデータベースでは、2文字以上の検索語を部分一致で検索する (インデックスは使えない)。
+    """
+
+    key = normalize_search_text(word)
+    if not key:
+        return None
+
+    if len(key) < MIN_QUERY_LENGTH:
+        return {f'{field_name}__startswith': key}
+    return {f'{field_name}__contains': key}
+
+
+class SearchKeyField(models.CharField):
+    """source_fieldの値を検索用に正規化して保持するフィールド (save・bulk_createの際に値を生成)"""
+
+    def __init__(self, *args, source_field=None, **kwargs):
+        self.source_field = source_field
+        kwargs.setdefault('max_length', 255)
+        kwargs.setdefault('default', '')
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source_field'] = self.source_field
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = normalize_search_text(getattr(model_instance, self.source_field))[:self.max_length]
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def tokenize(text):
+    """正規化した文字列をbigramに分割"""
+
+    text = normalize_search_text(text)
+    if len(text) < MIN_QUERY_LENGTH:
+        return [text] if text else []
+
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+class SQLiteSearchBackend():
+    """SQLiteのFTS5仮想テーブルを使う検索バックエンド"""
+
+    table_name = 'search_document_fts'
+    available = False
+
+    def is_available(self):
+        # FTS5が使えない環境では仮想テーブルが作成されないため、テーブルの有無で判定する
+        if not SQLiteSearchBackend.available:
+            SQLiteSearchBackend.available = self.table_name in connection.introspection.table_names()
+        return SQLiteSearchBackend.available
+
+    def get_match_sql(self, word):
+        # bigramを連続したフレーズとして検索する
+        tokens = tokenize(word)
+        return (
+            f'SELECT rowid FROM {self.table_name} WHERE {self.table_name} MATCH %s',
+            ['"{}"'.format(' '.join(tokens))],
+        )
+
+
+class PostgreSQLSearchBackend():
+    """PostgreSQLのGINインデックス (bigramの配列) を使う検索バックエンド"""
+
+    def is_available(self):
+        return True
+
+    def get_match_sql(self, word):
+        # bigramをすべて含む文書をインデックスで絞り込み、正規化した文字列で部分一致を確認する
+        return (
+            "SELECT id FROM search_document WHERE string_to_array(tokens, ' ') @> %s::text[] AND text LIKE %s",
+            [tokenize(word), '%{}%'.format(normalize_search_text(word))],
+        )
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_search_backend():
+    """データベースに対応した検索バックエンドを取得 (使用できない場合はNone)"""
+
+    backend_class = SEARCH_BACKENDS.get(connection.vendor)
+    if backend_class is None:
+        return None
+
+    backend = backend_class()
+    return backend if backend.is_available() else None
+
+
+def get_match_expression(word):
+    """検索語に一致するSearchDocumentのIDを返すサブクエリを取得 (インデックスが使えない場合はNone)"""
+
+    if len(normalize_search_text(word)) < MIN_QUERY_LENGTH:
+        return None
+
+    backend = get_search_backend()
+    if backend is None:
+        return None
+
+    return RawSQL(*backend.get_match_sql(word))
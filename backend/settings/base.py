@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.gzip.GZipMiddleware',
+    'backend.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -74,6 +75,76 @@ DATABASES = {
     }
 }
 
+# ユーザーごとのAPIレスポンスのキャッシュ (書き込み時にバージョンを更新して無効化)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+USER_CACHE_TIMEOUT = 60 * 60 * 24
+
+# リクエスト後のバックグラウンドタスク (孤立した著者の削除など) をプロセス内で実行するか
+BACKGROUND_TASKS_ENABLED = True
+
+# StatusLog・Noteのストリーミング取得 (?stream=1) の上限件数と1回のクエリで取得する件数
+TIMELINE_STREAM_MAX_ITEMS = 5000
+TIMELINE_STREAM_CHUNK_SIZE = 500
+
+# エクスポート時に1回のクエリで取得する件数
+EXPORT_CHUNK_SIZE = 1000
+
+# 一括登録で1リクエストに指定できる書籍の上限
+IMPORT_MAX_ROWS = 5000
+# ステータスの一括登録で1リクエストに指定できる件数の上限
+STATUS_BATCH_MAX_ITEMS = 1000
+# 一括登録のリクエストを受け付けられるよう、リクエストボディの上限を引き上げる
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+
+# リクエストごとのSQL・シリアライズのプロファイリング (backend.profiling)
+# SAMPLE_RATE: 記録するリクエストの割合 (X-Profileヘッダを付けたスタッフユーザーのリクエストは常に記録)
+# SLOW_QUERIES: ログに出力する遅いSQLの件数、SERVER_TIMING: 全ての記録したレスポンスにServer-Timingヘッダを付けるか
+# WINDOW: エンドポイントごとに保持する直近のリクエスト数、ALLOW_FORCE: スタッフユーザー以外のX-Profileヘッダも受け付けるか
+PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.05,
+    'SLOW_QUERIES': 5,
+    'SERVER_TIMING': False,
+    'WINDOW': 500,
+    'ALLOW_FORCE': False,
+}
+
+# Google Books APIの書籍情報のキャッシュ (backend.metadata)
+# UPSTREAM・OPTIONS: 取得に使うクラスとその引数 (api_urlでテスト用のサーバーにも向けられる)
+# TTL・NOT_FOUND_TTL: 取得し直すまでの秒数 (見つからなかった書籍は短くする)、MAX_ENTRIES: 保持する件数の上限
+BOOK_METADATA = {
+    'UPSTREAM': 'backend.metadata.GoogleBooksUpstream',
+    'OPTIONS': {
+        'api_url': 'https://www.googleapis.com/books/v1/volumes',
+        'api_key': os.environ.get('GOOGLE_BOOKS_API_KEY'),
+        'timeout': 5,
+    },
+    'TTL': 60 * 60 * 24 * 30,
+    'NOT_FOUND_TTL': 60 * 60 * 24,
+    'MAX_ENTRIES': 100000,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'yomlog.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
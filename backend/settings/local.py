@@ -12,6 +12,8 @@ INTERNAL_IPS = [
     # '127.0.0.1',
 ]
 
+PROFILING.update({'ENABLED': True, 'SAMPLE_RATE': 1.0, 'SERVER_TIMING': True, 'ALLOW_FORCE': True})
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 CORS_ORIGIN_ALLOW_ALL = True
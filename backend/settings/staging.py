@@ -14,6 +14,15 @@ REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
 db_from_env = dj_database_url.config()
 DATABASES['default'].update(db_from_env)
 
+# 複数のワーカー間でキャッシュのバージョンを共有する
+CACHES['default'] = {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'cache_table',
+}
+
+# 一部のリクエストのみプロファイリングする
+PROFILING['ENABLED'] = True
+
 DEFAULT_FROM_EMAIL = os.environ['EMAIL_FROM']
 INQUIRY_EMAIL = os.environ['EMAIL_FROM']
 EMAIL_HOST = 'smtp.sendgrid.net'
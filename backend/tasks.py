@@ -0,0 +1,51 @@
+"""
+プロセス内のバックグラウンドタスク
+
+リクエストの処理を待たせないよう、トランザクションのコミット後に別スレッドで実行する。
+プロセスの終了などで実行されなかったタスクは、DBに残した印を元に管理コマンドで処理する。
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from threading import Lock
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 共有のテーブルへの書き込みが競合しないよう、1スレッドで順に実行する
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='yomlog-task')
+_scheduled = set()
+_lock = Lock()
+
+
+def _run(name, func, args, kwargs):
+    if name is not None:
+        with _lock:
+            _scheduled.discard(name)
+
+    close_old_connections()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('バックグラウンドタスクの実行に失敗しました: %s', name or func.__qualname__)
+    finally:
+        connection.close()
+
+
+def run_in_background(func, *args, name=None, **kwargs):
+    """トランザクションのコミット後に、funcをバックグラウンドで実行 (nameを指定した場合、同じnameの待機中のタスクとまとめる)"""
+
+    def submit():
+        if not settings.BACKGROUND_TASKS_ENABLED:
+            return
+
+        if name is not None:
+            with _lock:
+                if name in _scheduled:
+                    return
+                _scheduled.add(name)
+
+        _executor.submit(_run, name, func, args, kwargs)
+
+    transaction.on_commit(submit)
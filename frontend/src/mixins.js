@@ -50,6 +50,9 @@ export const BookListMixin = {
       return function (book) {
         if (book.status !== undefined && book.status.length) {
           return book.status[0]
+        } else if (book.progress !== undefined) {
+          // 一覧APIから取得した本は、現在の進捗のみを持つ
+          return book.progress
         } else {
           return {
             id: null,
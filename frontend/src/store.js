@@ -21,7 +21,6 @@ const authModule = {
     avatar_thumbnail: '',
     date_joined: '',
     is_superuser: false,
-    analytics: null,
     isLoggedIn: false,
   },
   getters: {
@@ -226,6 +225,18 @@ const bookListModule = {
       const cacheIndex = state.caches.findIndex((e) => e.id === book.id)
       if (cacheIndex < 0) state.caches.push(book)
     },
+    updateCache(state, book) {
+      const cacheIndex = state.caches.findIndex((e) => e.id === book.id)
+      if (cacheIndex < 0) state.caches.push(book)
+      else state.caches.splice(cacheIndex, 1, book)
+    },
+    updateList(state, book) {
+      const listIndex = state.items.findIndex((e) => e.id === book.id)
+      if (listIndex >= 0) state.items.splice(listIndex, 1, book)
+    },
+    assign(state, { book, props }) {
+      Object.assign(book, props)
+    },
     set(state, book) {
       const listIndex = state.items.findIndex((e) => e.id === book.id)
       state.items.splice(listIndex, 1, book)
@@ -254,28 +265,42 @@ const bookListModule = {
       try {
         // 本のデータをキャッシュストア or APIから取得 (参照渡し)
         let result = state.caches.find((e) => e.id === id)
-        if (!result) {
+        // 一覧APIから取得した本は履歴・メモを持たないため、詳細を取得し直す
+        if (!result || result.status === undefined) {
           result = (await api.get(`/book/${id}/`)).data
-          commit('addCache', result)
+          commit('updateCache', result)
         }
         return result
       } catch (error) {
         return Promise.reject(error)
       }
     },
-    async reflectBookProp({ dispatch }, { id }) {
-      // 指定されたidの本をAPIから取得し、キャッシュストアに反映させる
+    async reflectBookProp({ state, commit, dispatch }, { id }) {
+      // 指定されたidの本をAPIから取得し、キャッシュストア・本棚リストに反映させる
 
       dispatch('auth/reload', null, { root: true }) // ユーザー情報の更新
 
-      const book = await dispatch('getBookItem', { id })
-      const oldState = JSON.stringify(book.status[0])
+      // 更新前の読書状態は、APIから取得し直す前のキャッシュ or 本棚リストの本 (一覧の要約を含む) から取得
+      const getState = (book) =>
+        book ? JSON.stringify([book.state, book.current_position]) : null
+      const oldState = getState(
+        state.caches.find((e) => e.id === id) ||
+          state.items.find((e) => e.id === id)
+      )
 
       // APIから更新された書籍データを取得
       const newBook = (await api.get(`/book/${id}/`)).data
-      book.note = newBook.note
-      book.status = newBook.status
-      const newState = JSON.stringify(book.status[0])
+      const book = state.caches.find((e) => e.id === id)
+      if (book && book.status !== undefined) {
+        // 詳細ページなどが参照しているキャッシュの本は、参照を保ったまま更新する
+        commit('assign', { book, props: newBook })
+      } else {
+        commit('updateCache', newBook)
+      }
+
+      // 本棚リストの本も、最新の進捗を表示するよう置き換える
+      commit('updateList', state.caches.find((e) => e.id === id))
+      const newState = getState(newBook)
 
       if (oldState !== newState) {
         // 本棚ページを表示中でない場合、バックグラウンドで現在の本棚リストを更新
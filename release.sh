@@ -1,2 +1,3 @@
 #!/bin/bash
 python manage.py migrate
+python manage.py createcachetable